@@ -1,15 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Request, Depends, HTTPException
-from fastapi_jwt_auth import AuthJWT
-from motor.motor_asyncio import AsyncIOMotorClient
-from starlette.status import HTTP_201_CREATED, HTTP_200_OK, HTTP_403_FORBIDDEN
+from fastapi import APIRouter, Request, Response, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.status import HTTP_201_CREATED, HTTP_200_OK, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND, \
+    HTTP_422_UNPROCESSABLE_ENTITY, HTTP_304_NOT_MODIFIED
 
-from app.api.db.mongodb import get_database
-from app.api.models.document import DocumentWithAuthor, Document, DocumentUpdate
+from app.api.helpers.auth import get_authorized_user, get_document_manager, get_user_manager
+from app.api.helpers.responses import MongoJSONResponse
+from app.api.models.document import DocumentWithAuthor, Document, DocumentUpdate, DocumentBulkResult
 from app.api.models.types import OID
+from app.api.models.user import UserInfo
 from app.api.services.documents import DocumentManager
 from app.api.services.users import UserManager
 
@@ -27,24 +29,41 @@ async def get_documents(
                         folder_id: OID,
                         skip: int = 0,
                         limit: int = 100,
-                        auth: AuthJWT = Depends(),
-                        db: AsyncIOMotorClient = Depends(get_database)):
+                        cursor: Optional[str] = None,
+                        after_number: Optional[int] = None,
+                        current_user: UserInfo = Depends(get_authorized_user),
+                        dm: DocumentManager = Depends(get_document_manager),
+                        um: UserManager = Depends(get_user_manager)):
     """
     Получение документов из папки с поддержкой пагинации.
     
     - **folder_id**: ID папки
     - **skip**: Количество документов, которые нужно пропустить (для пагинации)
     - **limit**: Максимальное количество документов для возврата
+    - **cursor**: Курсор следующей страницы из заголовка X-Next-Cursor предыдущего ответа
+    - **after_number**: Вернуть документы с номером больше указанного
+
+    Если задан cursor или after_number, используется курсорная пагинация (skip игнорируется),
+    а курсор следующей страницы возвращается в заголовке X-Next-Cursor.
     """
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
     if not current_user.isActive:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Пользователь заблокирован')
-    dm = DocumentManager(config=config, db=db, who=current_user)
-    return await dm.get_documents(folder_id=folder_id, um=um, skip=skip, limit=limit)
+    if cursor is not None or after_number is not None:
+        if limit < 1:
+            raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail='limit должен быть больше 0')
+        documents, next_cursor = await dm.get_documents_after(folder_id=folder_id,
+                                                              um=um,
+                                                              limit=limit,
+                                                              cursor=cursor,
+                                                              after_number=after_number)
+        return MongoJSONResponse(documents, headers={'X-Next-Cursor': next_cursor} if next_cursor else None)
+    body, etag = await dm.get_documents(folder_id=folder_id, um=um, skip=skip, limit=limit,
+                                        if_none_match=request.headers.get('If-None-Match'))
+    # no-cache: браузер хранит ответ, но каждый раз перепроверяет его по ETag
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if body is None:
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
 
 
 @router.post(
@@ -54,18 +73,36 @@ async def get_documents(
     status_code=HTTP_201_CREATED
 )
 async def create_document(doc: Document,
-                          request: Request,
-                          auth: AuthJWT = Depends(),
-                          db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
-    dm = DocumentManager(config=config, db=db, who=current_user)
+                          current_user: UserInfo = Depends(get_authorized_user),
+                          dm: DocumentManager = Depends(get_document_manager)):
     return await dm.create_new(new_data=doc)
 
 
+@router.post(
+    '/bulk',
+    tags=['Documents'],
+    response_model=List[DocumentBulkResult],
+    status_code=HTTP_200_OK
+)
+async def create_documents_bulk(docs: List[Document],
+                                request: Request,
+                                current_user: UserInfo = Depends(get_authorized_user),
+                                dm: DocumentManager = Depends(get_document_manager)):
+    """
+    Пакетное создание документов (например, при регистрации чертежей из CAD).
+
+    Возвращает результат для каждого документа в порядке запроса: status_code 201 и id созданного
+    документа либо код ошибки (403, 409, 400) с описанием в detail.
+    """
+    config = request.app.config
+    if not current_user.isActive:
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Пользователь заблокирован')
+    if len(docs) > config['BULK_MAX_DOCUMENTS']:
+        raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f'Не более {config["BULK_MAX_DOCUMENTS"]} документов за запрос')
+    return await dm.create_many(new_docs=docs)
+
+
 @router.patch(
     '/{doc_id}',
     tags=['Documents'],
@@ -74,15 +111,8 @@ async def create_document(doc: Document,
 )
 async def update_document(doc_id: OID,
                           doc: DocumentUpdate,
-                          request: Request,
-                          auth: AuthJWT = Depends(),
-                          db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
-    dm = DocumentManager(config=config, db=db, who=current_user)
+                          current_user: UserInfo = Depends(get_authorized_user),
+                          dm: DocumentManager = Depends(get_document_manager)):
     return await dm.update(doc_id=doc_id, new_data=doc)
 
 
@@ -92,15 +122,8 @@ async def update_document(doc_id: OID,
     status_code=HTTP_200_OK
 )
 async def remove_document(doc_id: OID,
-                          request: Request,
-                          auth: AuthJWT = Depends(),
-                          db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
-    dm = DocumentManager(config=config, db=db, who=current_user)
+                          current_user: UserInfo = Depends(get_authorized_user),
+                          dm: DocumentManager = Depends(get_document_manager)):
     return await dm.remove_document(doc_id=doc_id)
 
 
@@ -110,10 +133,9 @@ async def remove_document(doc_id: OID,
     status_code=HTTP_200_OK
 )
 async def get_projects_by_folders(
-                        request: Request,
                         folder_ids: str,
-                        auth: AuthJWT = Depends(),
-                        db: AsyncIOMotorClient = Depends(get_database)):
+                        current_user: UserInfo = Depends(get_authorized_user),
+                        dm: DocumentManager = Depends(get_document_manager)):
     """
     Получение проектов для нескольких папок одним запросом.
     
@@ -121,18 +143,12 @@ async def get_projects_by_folders(
     
     Возвращает словарь, где ключи - это ID папок, а значения - списки проектов.
     """
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
     if not current_user.isActive:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Пользователь заблокирован')
     
-    dm = DocumentManager(config=config, db=db, who=current_user)
     
     # Разбиваем строку с ID папок на список и преобразуем в OID
-    folder_id_list = [OID(fid.strip()) for fid in folder_ids.split(',') if fid.strip()]
+    folder_id_list = [OID.validate(fid.strip()) for fid in folder_ids.split(',') if fid.strip()]
     
     # Используем новый оптимизированный метод для получения проектов
     return await dm.get_projects_for_folders(folder_ids=folder_id_list)
@@ -145,9 +161,8 @@ async def get_projects_by_folders(
 )
 async def get_projects_by_folder_group(
                         fg_id: OID,
-                        request: Request,
-                        auth: AuthJWT = Depends(),
-                        db: AsyncIOMotorClient = Depends(get_database)):
+                        current_user: UserInfo = Depends(get_authorized_user),
+                        dm: DocumentManager = Depends(get_document_manager)):
     """
     Получение проектов для всех папок группы одним запросом.
     
@@ -155,23 +170,58 @@ async def get_projects_by_folder_group(
     
     Возвращает словарь, где ключи - это ID папок, а значения - списки проектов.
     """
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
     if not current_user.isActive:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Пользователь заблокирован')
     
     # Получаем все папки для указанной группы
-    folder_collection = db.client[config['MONGO_DB']]['folders']
     folders = []
-    async for folder in folder_collection.find({"folderGroupId": fg_id}):
+    async for folder in dm.folder_collection.find({"folderGroupId": fg_id}, projection={"_id": 1}):
         folders.append(folder["_id"])
     
     if not folders:
         return {}
     
     # Используем оптимизированный метод для получения проектов всех папок
-    dm = DocumentManager(config=config, db=db, who=current_user)
     return await dm.get_projects_for_folders(folder_ids=folders)
+
+
+@router.get(
+    '/export',
+    tags=['Documents'],
+    status_code=HTTP_200_OK
+)
+async def export_documents(
+                        folder_id: Optional[OID] = None,
+                        fg_id: Optional[OID] = None,
+                        export_format: str = Query('ndjson', alias='format', regex='^(ndjson|csv)$'),
+                        current_user: UserInfo = Depends(get_authorized_user),
+                        dm: DocumentManager = Depends(get_document_manager),
+                        um: UserManager = Depends(get_user_manager)):
+    """
+    Потоковая выгрузка всех документов папки или группы папок.
+
+    - **folder_id**: ID папки
+    - **fg_id**: ID группы папок (выгружаются все ее папки)
+    - **format**: ndjson (по умолчанию) или csv
+    """
+    if not current_user.isActive:
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Пользователь заблокирован')
+    if (folder_id is None) == (fg_id is None):
+        raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail='Укажите folder_id или fg_id')
+
+    if folder_id is not None:
+        folder_ids = [folder_id]
+        file_name = f'folder_{folder_id}'
+    else:
+        folder_ids = [folder['_id'] async for folder in
+                      dm.folder_collection.find({'folderGroupId': fg_id}, projection={'_id': 1})]
+        if not folder_ids:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='В группе нет папок')
+        file_name = f'folder_group_{fg_id}'
+
+    media_type = 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(
+        dm.export_documents(folder_ids=folder_ids, um=um, export_format=export_format),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{file_name}.{export_format}"'},
+    )
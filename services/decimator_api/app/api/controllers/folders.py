@@ -2,16 +2,15 @@
 # -*- coding: utf-8 -*-
 from typing import List
 
-from fastapi import APIRouter, Request, Depends, HTTPException
-from fastapi_jwt_auth import AuthJWT
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, Depends, HTTPException, Query
 from starlette.status import HTTP_201_CREATED, HTTP_200_OK, HTTP_403_FORBIDDEN, HTTP_422_UNPROCESSABLE_ENTITY
 
-from app.api.db.mongodb import get_database
+from app.api.helpers.auth import get_authorized_user, get_folder_manager
+from app.api.helpers.responses import MongoJSONResponse
 from app.api.models.folder import FolderInfo, Folder, Reserve
 from app.api.models.types import OID
+from app.api.models.user import UserInfo
 from app.api.services.folders import FolderManager
-from app.api.services.users import UserManager
 
 router = APIRouter()
 
@@ -23,15 +22,8 @@ router = APIRouter()
     status_code=HTTP_201_CREATED
 )
 async def create_folder(folder: Folder,
-                        request: Request,
-                        auth: AuthJWT = Depends(),
-                        db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
-    fm = FolderManager(config=config, db=db, who=current_user)
+                        current_user: UserInfo = Depends(get_authorized_user),
+                        fm: FolderManager = Depends(get_folder_manager)):
     return await fm.create_new(new_data=folder)
 
 
@@ -43,17 +35,10 @@ async def create_folder(folder: Folder,
 )
 async def update_folder(folder_id: OID,
                         new_name: str,
-                        request: Request,
-                        auth: AuthJWT = Depends(),
-                        db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+                        current_user: UserInfo = Depends(get_authorized_user),
+                        fm: FolderManager = Depends(get_folder_manager)):
     if not current_user.isSuper:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав изменять папки')
-    fm = FolderManager(config=config, db=db, who=current_user)
     return await fm.update(folder_id=folder_id, new_name=new_name)
 
 
@@ -65,20 +50,49 @@ async def update_folder(folder_id: OID,
 )
 async def create_reserve(reserve: Reserve,
                          folder_id: OID,
-                         request: Request,
-                         auth: AuthJWT = Depends(),
-                         db: AsyncIOMotorClient = Depends(get_database)):
+                         current_user: UserInfo = Depends(get_authorized_user),
+                         fm: FolderManager = Depends(get_folder_manager)):
     if reserve.from_ > reserve.to_:
         raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail='Неверные границы резерва')
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
-    fm = FolderManager(config=config, db=db, who=current_user)
     return await fm.create_reserve(folder_id=folder_id, reserve=reserve)
 
 
+@router.get(
+    '/{folder_id}/next_number',
+    tags=['Folders'],
+    status_code=HTTP_200_OK
+)
+async def get_next_numbers(folder_id: OID,
+                           count: int = Query(1, ge=1, le=100),
+                           current_user: UserInfo = Depends(get_authorized_user),
+                           fm: FolderManager = Depends(get_folder_manager)):
+    """
+    Наименьшие свободные номера документов в папке (без захвата).
+
+    - **count**: Сколько номеров вернуть
+    """
+    return {'numbers': await fm.next_numbers(folder_id=folder_id, count=count)}
+
+
+@router.post(
+    '/{folder_id}/next_number',
+    tags=['Folders'],
+    status_code=HTTP_200_OK
+)
+async def claim_next_numbers(folder_id: OID,
+                             count: int = Query(1, ge=1, le=100),
+                             current_user: UserInfo = Depends(get_authorized_user),
+                             fm: FolderManager = Depends(get_folder_manager)):
+    """
+    Захват наименьших свободных номеров документов в папке.
+    Захваченные номера не выдаются другим пользователям и не могут быть ими заняты
+    в течение NUMBER_CLAIM_TTL секунд.
+
+    - **count**: Сколько номеров захватить
+    """
+    return {'numbers': await fm.next_numbers(folder_id=folder_id, count=count, claim=True)}
+
+
 @router.get(
     '/{fgs_id}',
     tags=['Folders'],
@@ -86,12 +100,11 @@ async def create_reserve(reserve: Reserve,
     status_code=HTTP_200_OK
 )
 async def get_folders(fgs_id: OID,
-                      request: Request,
                       skip: int = 0, 
                       limit: int = 100,
                       include_reserves: bool = False,
-                      auth: AuthJWT = Depends(),
-                      db: AsyncIOMotorClient = Depends(get_database)):
+                      current_user: UserInfo = Depends(get_authorized_user),
+                      fm: FolderManager = Depends(get_folder_manager)):
     """
     Получение папок с поддержкой пагинации и фильтрации полей.
     
@@ -100,15 +113,10 @@ async def get_folders(fgs_id: OID,
     - **limit**: Максимальное количество папок для возврата
     - **include_reserves**: Включать ли поле reserves в ответ (по умолчанию нет для оптимизации)
     """
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
-    fm = FolderManager(config=config, db=db, who=current_user)
     # Используем проекцию и пагинацию для оптимизации
     # Настройки фильтрации передаются через параметры запроса
-    return await fm.get_folders(fgs_id=fgs_id, skip=skip, limit=limit, include_reserves=include_reserves)
+    return MongoJSONResponse(await fm.get_folders(fgs_id=fgs_id, skip=skip, limit=limit,
+                                                  include_reserves=include_reserves))
 
 
 @router.delete(
@@ -117,17 +125,10 @@ async def get_folders(fgs_id: OID,
     status_code=HTTP_200_OK
 )
 async def remove_folder(folder_id: OID,
-                        request: Request,
-                        auth: AuthJWT = Depends(),
-                        db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+                        current_user: UserInfo = Depends(get_authorized_user),
+                        fm: FolderManager = Depends(get_folder_manager)):
     if not current_user.isSuper:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав удалять папки')
-    fm = FolderManager(config=config, db=db, who=current_user)
     return await fm.remove_folder(folder_id=folder_id)
 
 
@@ -139,13 +140,6 @@ async def remove_folder(folder_id: OID,
 )
 async def remove_reserve(folder_id: OID,
                          reserve_id: OID,
-                         request: Request,
-                         auth: AuthJWT = Depends(),
-                         db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
-    fm = FolderManager(config=config, db=db, who=current_user)
+                         current_user: UserInfo = Depends(get_authorized_user),
+                         fm: FolderManager = Depends(get_folder_manager)):
     return await fm.remove_reserve(folder_id=folder_id, reserve_id=reserve_id)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import hmac
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from starlette.responses import PlainTextResponse
+from starlette.status import HTTP_401_UNAUTHORIZED
+
+from app.api.helpers import passwords
+from app.api.helpers.metrics import render_metrics
+from app.api.services.documents import DOCUMENTS_CACHE
+from app.api.services.folders import RESERVES_CACHE, NUMBER_ALLOCATORS
+from app.api.services.hierarchy import ORG_ACCESS, FOLDER_GROUP_BY_FOLDER, ORG_BY_FOLDER_GROUP
+from app.api.services.orgs import ORGS_CACHE
+from app.api.services.users import USERS_CACHE, AUTHORS_CACHE
+
+router = APIRouter()
+
+CACHES = {
+    'documents': DOCUMENTS_CACHE,
+    'users': USERS_CACHE,
+    'authors': AUTHORS_CACHE,
+    'reserves': RESERVES_CACHE,
+    'number_allocators': NUMBER_ALLOCATORS,
+    'orgs': ORGS_CACHE,
+    'org_access': ORG_ACCESS,
+    'folder_groups_by_folder': FOLDER_GROUP_BY_FOLDER,
+    'orgs_by_folder_group': ORG_BY_FOLDER_GROUP,
+}
+
+
+async def check_metrics_token(request: Request):
+    """Проверяет токен сборщика метрик, если он задан в METRICS_TOKEN"""
+    token = request.app.config['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '').encode()
+    if token and not hmac.compare_digest(authorization, f'Bearer {token}'.encode()):
+        raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail='Неверный токен метрик')
+
+
+@router.get('/metrics', include_in_schema=False, dependencies=[Depends(check_metrics_token)])
+async def get_metrics():
+    return PlainTextResponse(render_metrics(caches=CACHES, latencies={'login': passwords.LOGIN_LATENCY}),
+                             media_type='text/plain; version=0.0.4')
@@ -2,15 +2,15 @@
 # -*- coding: utf-8 -*-
 from typing import List
 
-from fastapi import APIRouter, Request, Depends, HTTPException
-from fastapi_jwt_auth import AuthJWT
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import APIRouter, Depends, HTTPException
 from starlette.status import HTTP_201_CREATED, HTTP_403_FORBIDDEN, HTTP_200_OK
 
-from app.api.db.mongodb import get_database
+from app.api.helpers.auth import get_authorized_user, get_org_manager, get_user_manager
+from app.api.helpers.responses import MongoJSONResponse
 from app.api.models.folder_group import FolderGroup, FolderGroupInfo
 from app.api.models.org import OrgInfo, Org
 from app.api.models.types import OID
+from app.api.models.user import UserInfo
 from app.api.services.orgs import OrgManager
 from app.api.services.users import UserManager
 
@@ -23,16 +23,11 @@ router = APIRouter()
     response_model=List[OrgInfo],
     status_code=HTTP_200_OK
 )
-async def get_orgs(request: Request, auth: AuthJWT = Depends(), db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+async def get_orgs(current_user: UserInfo = Depends(get_authorized_user),
+                   om: OrgManager = Depends(get_org_manager)):
     if not current_user.isActive:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Пользователь заблокирован')
-    om = OrgManager(config=config, db=db, who=current_user)
-    return await om.get_orgs()
+    return MongoJSONResponse(await om.get_orgs())
 
 
 @router.post(
@@ -42,17 +37,10 @@ async def get_orgs(request: Request, auth: AuthJWT = Depends(), db: AsyncIOMotor
     status_code=HTTP_201_CREATED
 )
 async def create_org(org: Org,
-                     request: Request,
-                     auth: AuthJWT = Depends(),
-                     db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+                     current_user: UserInfo = Depends(get_authorized_user),
+                     om: OrgManager = Depends(get_org_manager)):
     if not current_user.isSuper:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав создавать организации')
-    om = OrgManager(config=config, db=db, who=current_user)
     return await om.create_new(new_data=org)
 
 
@@ -63,18 +51,14 @@ async def create_org(org: Org,
     status_code=HTTP_200_OK
 )
 async def remove_org(org_id: OID,
-                     request: Request,
-                     auth: AuthJWT = Depends(),
-                     db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+                     only_changed: bool = False,
+                     current_user: UserInfo = Depends(get_authorized_user),
+                     om: OrgManager = Depends(get_org_manager)):
     if not current_user.isSuper:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав удалять организации')
-    om = OrgManager(config=config, db=db, who=current_user)
     await om.set_inactive(org_id=org_id)
+    if only_changed:
+        return [await om.get_org(org_id=org_id)]
     return await om.get_orgs()
 
 
@@ -86,18 +70,14 @@ async def remove_org(org_id: OID,
 )
 async def update_org(org_id: OID,
                      new_org: Org,
-                     request: Request,
-                     auth: AuthJWT = Depends(),
-                     db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+                     only_changed: bool = False,
+                     current_user: UserInfo = Depends(get_authorized_user),
+                     om: OrgManager = Depends(get_org_manager)):
     if not current_user.isSuper:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав изменять организации')
-    om = OrgManager(config=config, db=db, who=current_user)
     await om.update(_id=org_id, new_data=new_org)
+    if only_changed:
+        return [await om.get_org(org_id=org_id)]
     return await om.get_orgs()
 
 
@@ -108,18 +88,14 @@ async def update_org(org_id: OID,
     status_code=HTTP_200_OK
 )
 async def restore_org(org_id: OID,
-                      request: Request,
-                      auth: AuthJWT = Depends(),
-                      db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+                      only_changed: bool = False,
+                      current_user: UserInfo = Depends(get_authorized_user),
+                      om: OrgManager = Depends(get_org_manager)):
     if not current_user.isSuper:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав восстанавливать организации')
-    om = OrgManager(config=config, db=db, who=current_user)
     await om.set_active(org_id=org_id)
+    if only_changed:
+        return [await om.get_org(org_id=org_id)]
     return await om.get_orgs()
 
 
@@ -131,17 +107,10 @@ async def restore_org(org_id: OID,
 )
 async def add_folder_group_to_organization(fg: FolderGroup,
                                            org_id: OID,
-                                           request: Request,
-                                           auth: AuthJWT = Depends(),
-                                           db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+                                           current_user: UserInfo = Depends(get_authorized_user),
+                                           om: OrgManager = Depends(get_org_manager)):
     if not current_user.isSuper:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав создавать группы папок')
-    om = OrgManager(config=config, db=db, who=current_user)
     return await om.create_folder_group(fg=fg, org_id=org_id)
 
 
@@ -152,15 +121,8 @@ async def add_folder_group_to_organization(fg: FolderGroup,
     status_code=HTTP_200_OK
 )
 async def add_folder_group_to_organization(org_id: OID,
-                                           request: Request,
-                                           auth: AuthJWT = Depends(),
-                                           db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
-    om = OrgManager(config=config, db=db, who=current_user)
+                                           current_user: UserInfo = Depends(get_authorized_user),
+                                           om: OrgManager = Depends(get_org_manager)):
     return await om.get_folder_groups(org_id=org_id)
 
 
@@ -173,21 +135,19 @@ async def add_folder_group_to_organization(org_id: OID,
 async def add_users_to_organization(org_id: OID,
                                     user_ids: List[OID],
                                     is_writer: bool,
-                                    request: Request,
-                                    auth: AuthJWT = Depends(),
-                                    db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+                                    only_changed: bool = False,
+                                    current_user: UserInfo = Depends(get_authorized_user),
+                                    om: OrgManager = Depends(get_org_manager),
+                                    um: UserManager = Depends(get_user_manager)):
     if not current_user.isSuper:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав добавлять пользователей в организации')
-    is_users_exists = await um.ensure_existance(_ids=user_ids)
-    if not is_users_exists:
-        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Не верные идентификаторы пользователей')
-    om = OrgManager(config=config, db=db, who=current_user)
+    missing_ids = await um.find_missing_ids(_ids=user_ids)
+    if missing_ids:
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN,
+                            detail=f'Не верные идентификаторы пользователей: {", ".join(map(str, missing_ids))}')
     await om.add_users(org_id=org_id, user_ids=user_ids, is_writer=is_writer)
+    if only_changed:
+        return [await om.get_org(org_id=org_id)]
     return await om.get_orgs()
 
 
@@ -199,16 +159,12 @@ async def add_users_to_organization(org_id: OID,
 )
 async def remove_users_from_organization(org_id: OID,
                                          user_ids: List[OID],
-                                         request: Request,
-                                         auth: AuthJWT = Depends(),
-                                         db: AsyncIOMotorClient = Depends(get_database)):
-    config = request.app.config
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=config, db=db)
-    current_user = await um.get_user_by_login(login=user_login)
+                                         only_changed: bool = False,
+                                         current_user: UserInfo = Depends(get_authorized_user),
+                                         om: OrgManager = Depends(get_org_manager)):
     if not current_user.isSuper:
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав удалить пользователей из организации')
-    om = OrgManager(config=config, db=db, who=current_user)
     await om.remove_users(org_id=org_id, user_ids=user_ids)
+    if only_changed:
+        return [await om.get_org(org_id=org_id)]
     return await om.get_orgs()
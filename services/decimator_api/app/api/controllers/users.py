@@ -2,12 +2,13 @@
 # -*- coding: utf-8 -*-
 from typing import List, Dict, Any
 
-from fastapi import APIRouter, Request, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi_jwt_auth import AuthJWT
-from motor.motor_asyncio import AsyncIOMotorClient
-from starlette.status import HTTP_201_CREATED, HTTP_200_OK, HTTP_401_UNAUTHORIZED
+from starlette.status import HTTP_201_CREATED, HTTP_200_OK, HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN
 
-from app.api.db.mongodb import get_database
+from app.api.helpers import passwords
+from app.api.helpers.auth import get_authorized_user, get_user_manager
+from app.api.helpers.responses import MongoJSONResponse
 from app.api.models.user import UserCreate, UserInfo, UserLogin, UserPassword
 from app.api.services.users import UserManager
 
@@ -20,8 +21,7 @@ router = APIRouter()
     response_model=UserInfo,
     status_code=HTTP_201_CREATED
 )
-async def create_user(user: UserCreate, request: Request, db: AsyncIOMotorClient = Depends(get_database)):
-    um = UserManager(config=request.app.config, db=db)
+async def create_user(user: UserCreate, um: UserManager = Depends(get_user_manager)):
     return await um.create_new(new_data=user)
 
 
@@ -31,10 +31,8 @@ async def create_user(user: UserCreate, request: Request, db: AsyncIOMotorClient
     status_code=HTTP_200_OK
 )
 async def login(user: UserLogin,
-                request: Request,
                 auth: AuthJWT = Depends(),
-                db: AsyncIOMotorClient = Depends(get_database)):
-    um = UserManager(config=request.app.config, db=db)
+                um: UserManager = Depends(get_user_manager)):
     is_correct_credentials = await um.check_credentials(cred=user)
     if is_correct_credentials:
         return {'access_token': auth.create_access_token(subject=user.login, expires_time=False),
@@ -44,17 +42,25 @@ async def login(user: UserLogin,
         raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail='Неверный логин или пароль')
 
 
+@router.get(
+    '/auth/stats',
+    tags=['Users'],
+    status_code=HTTP_200_OK
+)
+async def get_login_stats(current_user: UserInfo = Depends(get_authorized_user)) -> Dict[str, Any]:
+    if not current_user.isSuper:
+        raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав')
+    return {'login_latency': passwords.LOGIN_LATENCY.stats(), 'bcrypt_rounds': passwords.BCRYPT_ROUNDS}
+
+
 @router.get(
     '/me',
     tags=['Users'],
     response_model=UserInfo,
     status_code=HTTP_200_OK
 )
-async def get_current_user(request: Request, auth: AuthJWT = Depends(), db: AsyncIOMotorClient = Depends(get_database)):
-    auth.jwt_required()
-    user_login = auth.get_jwt_subject()
-    um = UserManager(config=request.app.config, db=db)
-    return await um.get_user_by_login(login=user_login)
+async def get_current_user(current_user: UserInfo = Depends(get_authorized_user)):
+    return current_user
 
 
 @router.get(
@@ -63,10 +69,9 @@ async def get_current_user(request: Request, auth: AuthJWT = Depends(), db: Asyn
     response_model=List[UserInfo],
     status_code=HTTP_200_OK
 )
-async def get_users(request: Request, auth: AuthJWT = Depends(), db: AsyncIOMotorClient = Depends(get_database)):
+async def get_users(auth: AuthJWT = Depends(), um: UserManager = Depends(get_user_manager)):
     auth.jwt_required()
-    um = UserManager(config=request.app.config, db=db)
-    return await um.get_users()
+    return MongoJSONResponse(await um.get_users())
 
 
 @router.get(
@@ -77,17 +82,15 @@ async def get_users(request: Request, auth: AuthJWT = Depends(), db: AsyncIOMoto
 )
 async def get_user(
     user_id: str, 
-    request: Request, 
-    auth: AuthJWT = Depends(), 
-    db: AsyncIOMotorClient = Depends(get_database)
+    current_user: UserInfo = Depends(get_authorized_user),
+    um: UserManager = Depends(get_user_manager)
 ):
-    auth.jwt_required()
-    um = UserManager(config=request.app.config, db=db)
-    current_user = await get_current_user(request, auth, db)
-    
     # Проверка, что текущий пользователь супер или запрашивает информацию о себе
     if not current_user.isSuper and str(current_user.id) != user_id:
         raise HTTPException(status_code=403, detail="Недостаточно прав для просмотра информации о пользователе")
+    # Текущий пользователь уже загружен зависимостью авторизации
+    if str(current_user.id) == user_id:
+        return current_user
         
     return await um.get_user_by_id(user_id=user_id)
 
@@ -101,14 +104,9 @@ async def get_user(
 async def update_password(
     user_id: str, 
     new_password: UserPassword,
-    request: Request, 
-    auth: AuthJWT = Depends(), 
-    db: AsyncIOMotorClient = Depends(get_database)
+    current_user: UserInfo = Depends(get_authorized_user),
+    um: UserManager = Depends(get_user_manager)
 ):
-    auth.jwt_required()
-    um = UserManager(config=request.app.config, db=db)
-    current_user = await get_current_user(request, auth, db)
-    
     return await um.update_user_password(user_id=user_id, new_password=new_password, current_user=current_user)
 
 
@@ -121,14 +119,9 @@ async def update_password(
 async def update_login(
     user_id: str, 
     new_login: str,
-    request: Request, 
-    auth: AuthJWT = Depends(), 
-    db: AsyncIOMotorClient = Depends(get_database)
+    current_user: UserInfo = Depends(get_authorized_user),
+    um: UserManager = Depends(get_user_manager)
 ):
-    auth.jwt_required()
-    um = UserManager(config=request.app.config, db=db)
-    current_user = await get_current_user(request, auth, db)
-    
     return await um.update_user_login(user_id=user_id, new_login=new_login, current_user=current_user)
 
 
@@ -139,14 +132,9 @@ async def update_login(
 )
 async def delete_user(
     user_id: str, 
-    request: Request, 
-    auth: AuthJWT = Depends(), 
-    db: AsyncIOMotorClient = Depends(get_database)
+    current_user: UserInfo = Depends(get_authorized_user),
+    um: UserManager = Depends(get_user_manager)
 ):
-    auth.jwt_required()
-    um = UserManager(config=request.app.config, db=db)
-    current_user = await get_current_user(request, auth, db)
-    
     return await um.delete_user(user_id=user_id, current_user=current_user)
 
 
@@ -158,12 +146,7 @@ async def delete_user(
 )
 async def restore_user(
     user_id: str, 
-    request: Request, 
-    auth: AuthJWT = Depends(), 
-    db: AsyncIOMotorClient = Depends(get_database)
+    current_user: UserInfo = Depends(get_authorized_user),
+    um: UserManager = Depends(get_user_manager)
 ):
-    auth.jwt_required()
-    um = UserManager(config=request.app.config, db=db)
-    current_user = await get_current_user(request, auth, db)
-    
     return await um.restore_user(user_id=user_id, current_user=current_user)
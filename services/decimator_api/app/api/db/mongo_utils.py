@@ -1,14 +1,55 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import importlib.util
+import logging
+from typing import List
+
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from .mongodb import db
+from ..helpers.metrics import MongoCommandListener, MONGO_POOL
+
+logger = logging.getLogger(__name__)
+
+# Сжатие и модуль, без которого драйвер его не поддерживает (zlib - стандартная библиотека)
+COMPRESSOR_MODULES = {'zstd': 'zstandard', 'snappy': 'snappy', 'zlib': 'zlib'}
+
+
+def available_compressors(names: str) -> List[str]:
+    """Доступные в окружении алгоритмы сжатия из списка через запятую (в том же порядке)"""
+    compressors = []
+    for name in filter(None, (name.strip().lower() for name in names.split(','))):
+        module = COMPRESSOR_MODULES.get(name)
+        if module is None:
+            logger.warning("Неизвестный алгоритм сжатия MongoDB %s пропущен", name)
+        elif importlib.util.find_spec(module) is None:
+            logger.warning("Сжатие MongoDB %s недоступно: не установлен пакет %s", name, module)
+        else:
+            compressors.append(name)
+    return compressors
+
+
+def client_options(config: dict) -> dict:
+    """Параметры пула соединений и чтения для AsyncIOMotorClient из конфигурации"""
+    options = {
+        'maxPoolSize': int(config['MAX_CONNECTIONS_COUNT']),
+        'minPoolSize': int(config['MIN_CONNECTIONS_COUNT']),
+        # 0 в конфигурации - без ограничения, драйвер ожидает для этого None
+        'maxIdleTimeMS': int(config['MONGO_MAX_IDLE_TIME_MS']) or None,
+        'waitQueueTimeoutMS': int(config['MONGO_WAIT_QUEUE_TIMEOUT_MS']) or None,
+        'readPreference': config['MONGO_READ_PREFERENCE'],
+    }
+    compressors = available_compressors(config['MONGO_COMPRESSORS'])
+    if compressors:
+        options['compressors'] = compressors
+    if config['METRICS_ENABLED']:
+        MONGO_POOL.max_size = options['maxPoolSize']
+        options['event_listeners'] = [MongoCommandListener(), MONGO_POOL]
+    return options
 
 
 async def connect_to_mongo(config: dict):
-    db.client = AsyncIOMotorClient(config['MONGO_URI'],
-                                   maxPoolSize=config['MAX_CONNECTIONS_COUNT'],
-                                   minPoolSize=config['MIN_CONNECTIONS_COUNT'])
+    db.client = AsyncIOMotorClient(config['MONGO_URI'], **client_options(config))
     
     # Создаем индексы для оптимизации запросов после подключения
     await create_indexes(config)
@@ -30,9 +71,9 @@ async def create_indexes(config: dict):
     async def safe_create_index(collection, index_spec, **kwargs):
         try:
             await collection.create_index(index_spec, **kwargs)
-            print(f"Индекс {index_spec} успешно создан")
+            logger.debug("Индекс %s успешно создан", index_spec)
         except Exception as e:
-            print(f"Предупреждение при создании индекса {index_spec}: {e}")
+            logger.warning("Предупреждение при создании индекса %s: %s", index_spec, e)
     
     # Индексы для коллекции папок для ускорения поиска и сортировки
     folders_collection = mongo_db['folders']
@@ -45,8 +86,9 @@ async def create_indexes(config: dict):
     await safe_create_index(docs_collection, [("folderId", 1), ("project", 1)])
     
     # Дополнительные индексы для улучшения производительности
-    # Составной индекс для документов по папке и номеру для быстрой сортировки и поиска
-    await safe_create_index(docs_collection, [("folderId", 1), ("number", 1)])
+    # Составной индекс для документов по папке и номеру для быстрой сортировки и поиска.
+    # _id в конце покрывает сортировку курсорной пагинации (number, _id) без сортировки в памяти
+    await safe_create_index(docs_collection, [("folderId", 1), ("number", 1), ("_id", 1)])
     
     # Индекс для быстрого поиска по проектам
     await safe_create_index(docs_collection, "project")
@@ -54,6 +96,14 @@ async def create_indexes(config: dict):
     # Индекс для быстрой фильтрации по автору и папке
     await safe_create_index(docs_collection, [("authorId", 1), ("folderId", 1)])
     
+    # Индекс проектов папок: счетчики документов по (папка, проект)
+    await safe_create_index(mongo_db['folder_projects'], [("folderId", 1), ("project", 1)], unique=True)
+
+    # Захваты номеров документов: один захват на номер папки, истекшие удаляются MongoDB
+    number_claims_collection = mongo_db['number_claims']
+    await safe_create_index(number_claims_collection, [("folderId", 1), ("number", 1)], unique=True)
+    await safe_create_index(number_claims_collection, "expires", expireAfterSeconds=0)
+
     # Индексы для коллекции групп папок
     folder_groups_collection = mongo_db['folder_groups']
     await safe_create_index(folder_groups_collection, "orgId")
@@ -66,5 +116,8 @@ async def create_indexes(config: dict):
     orgs_collection = mongo_db['orgs']
     await safe_create_index(orgs_collection, "code", unique=True)
     await safe_create_index(orgs_collection, [("name", "text")])  # Текстовый индекс для поиска по названию
+    # Multikey-индексы для выборки организаций, доступных пользователю
+    await safe_create_index(orgs_collection, "canRead")
+    await safe_create_index(orgs_collection, "canWrite")
     
-    print("Индексы MongoDB успешно проверены или созданы для оптимизации запросов.")
+    logger.info("Индексы MongoDB успешно проверены или созданы для оптимизации запросов.")
@@ -8,7 +8,3 @@ class DataBase:
 
 
 db = DataBase()
-
-
-async def get_database():
-    return db
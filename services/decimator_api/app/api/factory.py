@@ -1,19 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import logging
-import os
-from logging.handlers import RotatingFileHandler
 from typing import Dict, Any
 
 from fastapi import FastAPI
-from fastapi.logger import logger
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_jwt_auth import AuthJWT
 from fastapi_jwt_auth.exceptions import AuthJWTException
 from requests import Request
 from starlette.responses import JSONResponse
 
+from .controllers.metrics import router as metrics_router
+from .helpers import passwords
+from .helpers.loaders import LoaderMiddleware
+from .helpers.log import init_logging, RequestIdMiddleware, REQUEST_ID_HEADER
+from .helpers.metrics import MetricsMiddleware
 from .router import router
+from .services.documents import DocumentManager
+from .services.hierarchy import HierarchyIndex
+from .services.orgs import OrgManager
+from .services.users import UserManager
 from pydantic import BaseModel
 
 
@@ -40,6 +46,7 @@ def create_app(config: Dict[str, Any]) -> FastAPI:
         allow_credentials=True,
         allow_methods=['*'],
         allow_headers=['*'],
+        expose_headers=['X-Next-Cursor', 'ETag', REQUEST_ID_HEADER],
     )
 
     class Settings(BaseModel):
@@ -59,18 +66,24 @@ def create_app(config: Dict[str, Any]) -> FastAPI:
     if not app.debug:
         init_logger(config)
     app.include_router(router, prefix=app.config["API_PREFIX"])
+    app.add_middleware(LoaderMiddleware)
+    if config['METRICS_ENABLED']:
+        app.add_middleware(MetricsMiddleware)
+        app.include_router(metrics_router)
+    app.add_middleware(RequestIdMiddleware)
     return app
 
 
+def configure_services(config: Dict[str, Any]):
+    """Apply cache and password hashing settings to the module-level service state"""
+    passwords.configure(config)
+    UserManager.configure_cache(config)
+    DocumentManager.configure_cache(config)
+    HierarchyIndex.configure_cache(config)
+    OrgManager.configure_cache(config)
+
+
 def init_logger(config: dict):
     """Set up the logger"""
-    if not os.path.exists(config['LOG_DIR']):
-        os.mkdir(config['LOG_DIR'])
-    file_handler = RotatingFileHandler(
-        f'{config["LOG_DIR"]}/service.log', maxBytes=10485760, backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(config['LOG_LEVEL'])
-    logger.addHandler(file_handler)
-    logger.info('************* SCOPE service startup ************* ')
+    init_logging(config)
+    logging.getLogger(__name__).info('************* SCOPE service startup ************* ')
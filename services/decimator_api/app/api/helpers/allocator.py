@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from bisect import bisect_left, insort
+from typing import Container, Dict, Hashable, Iterable, List, Set, Tuple
+
+from app.api.helpers.intervals import ReserveIndex
+
+
+class NumberAllocator:
+    """
+    Распределитель свободных номеров документов папки.
+
+    Хранит отсортированный список занятых номеров и документы на каждом номере (номер
+    повторяется в разных версиях), поэтому повторный учет того же документа ничего не меняет.
+    Поиск свободного номера перескакивает через резервы и через непрерывные серии занятых
+    номеров бинарным поиском, поэтому стоит O(log n) на выданный номер. Захваты номеров
+    хранятся в MongoDB (number_claims) и передаются в next_free как исключения.
+    """
+
+    def __init__(self, documents: Iterable[Tuple[int, Hashable]] = ()):
+        self._docs: Dict[int, Set[Hashable]] = {}
+        for number, doc_id in documents:
+            self._docs.setdefault(number, set()).add(doc_id)
+        self._taken: List[int] = sorted(self._docs)
+
+    def add(self, number: int, doc_id: Hashable):
+        """Учитывает документ doc_id с номером number"""
+        if number not in self._docs:
+            insort(self._taken, number)
+            self._docs[number] = set()
+        self._docs[number].add(doc_id)
+
+    def ensure(self, number: int):
+        """Отмечает номер занятым, если распределитель о нем не знал (документ создан другим процессом)"""
+        if number not in self._docs:
+            self.add(number, None)
+
+    def discard(self, number: int, doc_id: Hashable):
+        """Учитывает удаление документа doc_id с номера number"""
+        docs = self._docs.get(number)
+        if docs is None:
+            return
+        docs.discard(doc_id)
+        if not docs:
+            del self._docs[number]
+            del self._taken[bisect_left(self._taken, number)]
+
+    def next_free(self, reserves: ReserveIndex, *, count: int = 1, start: int = 0,
+                  exclude: Container[int] = ()) -> List[int]:
+        """Наименьшие count свободных номеров начиная со start, кроме номеров из exclude (захваченных)"""
+        result = []
+        number = start
+        while len(result) < count:
+            number = reserves.skip_reserved(number)
+            position = bisect_left(self._taken, number)
+            if position < len(self._taken) and self._taken[position] == number:
+                number = self._end_of_run(position) + 1
+                continue
+            if number not in exclude:
+                result.append(number)
+            number += 1
+        return result
+
+    def _end_of_run(self, position: int) -> int:
+        """Последний номер непрерывной серии занятых номеров, содержащей taken[position]"""
+        # В серии taken[i] - i постоянно, поэтому ее конец ищется бинарным поиском
+        offset = self._taken[position] - position
+        low, high = position, len(self._taken) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self._taken[middle] - middle == offset:
+                low = middle
+            else:
+                high = middle - 1
+        return self._taken[low]
@@ -3,10 +3,17 @@
 from functools import wraps
 from typing import Any
 
-from fastapi import HTTPException
-from starlette.status import HTTP_403_FORBIDDEN
+from fastapi import HTTPException, Request, Depends
+from fastapi_jwt_auth import AuthJWT
+from starlette.status import HTTP_403_FORBIDDEN, HTTP_401_UNAUTHORIZED
 
 from app.api.models.auth import RolePermission
+from app.api.models.user import UserInfo
+from app.api.services.documents import DocumentManager
+from app.api.services.folders import FolderManager
+from app.api.services.orgs import OrgManager
+from app.api.services.registry import Managers
+from app.api.services.users import UserManager
 
 roles = {
     'super': RolePermission(create=False, read=True, read_all=True, update=True, delete=True),
@@ -29,3 +36,38 @@ def permission_required(action_type):
             return await func(*args, **kwargs)
         return wrapper
     return decorator
+
+
+def get_managers(request: Request) -> Managers:
+    """Менеджеры, созданные при запуске приложения (app.managers)"""
+    return request.app.managers
+
+
+def get_user_manager(managers: Managers = Depends(get_managers)) -> UserManager:
+    return managers.users
+
+
+async def get_authorized_user(auth: AuthJWT = Depends(),
+                              um: UserManager = Depends(get_user_manager)) -> UserInfo:
+    """Общая зависимость: проверяет JWT и возвращает текущего пользователя (через кэш пользователей)"""
+    auth.jwt_required()
+    user_login = auth.get_jwt_subject()
+    current_user = await um.get_cached_user_by_login(login=user_login)
+    if not current_user:
+        raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail='Пользователь не найден')
+    return current_user
+
+
+def get_org_manager(managers: Managers = Depends(get_managers),
+                    current_user: UserInfo = Depends(get_authorized_user)) -> OrgManager:
+    return managers.orgs.for_user(current_user)
+
+
+def get_folder_manager(managers: Managers = Depends(get_managers),
+                       current_user: UserInfo = Depends(get_authorized_user)) -> FolderManager:
+    return managers.folders.for_user(current_user)
+
+
+def get_document_manager(managers: Managers = Depends(get_managers),
+                         current_user: UserInfo = Depends(get_authorized_user)) -> DocumentManager:
+    return managers.documents.for_user(current_user)
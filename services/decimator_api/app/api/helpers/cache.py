@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+def approx_sizeof(obj: Any) -> int:
+    """Приблизительный размер объекта в байтах (с учетом вложенных коллекций и моделей)"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_sizeof(key) + approx_sizeof(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_sizeof(item) for item in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += approx_sizeof(obj.__dict__)
+    return size
+
+
+class TTLCache:
+    """
+    LRU-кэш в памяти процесса с ограничением количества записей, объема и временем жизни записи.
+
+    Устаревшие записи удаляются при чтении, при переполнении (по количеству записей
+    или по приблизительному объему в байтах) вытесняется запись, к которой дольше всего
+    не обращались.
+    """
+
+    def __init__(self, *,
+                 maxsize: int = 1024,
+                 ttl: float = 60,
+                 maxbytes: int = 0,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # 0 - объем не ограничен и не подсчитывается
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof or approx_sizeof
+        # Структура: {key: (value, expires_at, size)}
+        self._data: OrderedDict = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, *, maxsize: Optional[int] = None, ttl: Optional[float] = None, maxbytes: Optional[int] = None):
+        """Меняет параметры кэша (вызывается при запуске приложения)"""
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if ttl is not None:
+            self.ttl = ttl
+        if maxbytes is not None:
+            self.maxbytes = maxbytes
+        self._evict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at, _ = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        size = self.sizeof(value) if self.maxbytes else 0
+        if self.maxbytes and size > self.maxbytes:
+            # Запись больше всего бюджета - не кэшируем, но и не вытесняем остальное
+            self.pop(key)
+            return
+        self.pop(key)
+        self._data[key] = (value, time.monotonic() + self.ttl, size)
+        self.bytes += size
+        self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._remove(key)
+        return default if entry is None else entry[0]
+
+    def pop_where(self, predicate: Callable[[Any], bool]) -> int:
+        """Удаляет все записи, значения которых удовлетворяют условию. Возвращает количество удаленных"""
+        keys = [key for key, (value, _, _) in self._data.items() if predicate(value)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        """Счетчики кэша: попадания, промахи, вытеснения и текущий объем"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self.bytes,
+            'maxsize': self.maxsize,
+            'maxbytes': self.maxbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remove(self, key: Hashable) -> Optional[tuple]:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+        return entry
+
+    def _evict(self):
+        while self._data and (len(self._data) > self.maxsize or (self.maxbytes and self.bytes > self.maxbytes)):
+            _, (_, _, size) = self._data.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[1] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
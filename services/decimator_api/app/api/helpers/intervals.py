@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from bisect import bisect_right
+from typing import Iterable, List, Tuple
+
+
+class ReserveIndex:
+    """
+    Интервальный индекс резервов папки для проверок пересечения за O(log n).
+
+    Интервалы [from_, to_] (включительно) хранятся отсортированными по началу вместе
+    с префиксным максимумом концов: среди интервалов, начинающихся не позже b, есть
+    пересекающий [a, b] тогда и только тогда, когда максимальный конец среди них >= a.
+    """
+
+    __slots__ = ('_starts', '_max_ends')
+
+    def __init__(self, intervals: Iterable[Tuple[int, int]] = ()):
+        self._starts: List[int] = []
+        self._max_ends: List[int] = []
+        max_end = None
+        for start, end in sorted(intervals):
+            max_end = end if max_end is None else max(max_end, end)
+            self._starts.append(start)
+            self._max_ends.append(max_end)
+
+    @classmethod
+    def from_db(cls, reserves: Iterable[dict]) -> 'ReserveIndex':
+        """Построение индекса по сырым резервам из MongoDB (без валидации моделей)"""
+        return cls((reserve['from_'], reserve['to_']) for reserve in reserves)
+
+    def overlaps(self, start: int, end: int) -> bool:
+        """Пересекается ли диапазон [start, end] хотя бы с одним резервом"""
+        position = bisect_right(self._starts, end) - 1
+        return position >= 0 and self._max_ends[position] >= start
+
+    def skip_reserved(self, number: int) -> int:
+        """Наименьший номер >= number, не попадающий ни в один резерв"""
+        while True:
+            position = bisect_right(self._starts, number) - 1
+            if position < 0 or self._max_ends[position] < number:
+                return number
+            number = self._max_ends[position] + 1
+
+    def __contains__(self, number: int) -> bool:
+        """Попадает ли номер в какой-либо резерв"""
+        return self.overlaps(number, number)
+
+    def __len__(self) -> int:
+        return len(self._starts)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional
+
+from bson import ObjectId
+from motor.core import AgnosticCollection
+
+# Загрузчики текущего запроса, устанавливаются LoaderMiddleware
+LOADERS: ContextVar[Optional['LoaderRegistry']] = ContextVar('loaders', default=None)
+
+
+class EntityLoader:
+    """
+    Загрузчик документов одной коллекции по _id (по образцу DataLoader).
+
+    Все запросы, сделанные за одну итерацию цикла событий, объединяются в один find с $in,
+    повторные запросы того же _id возвращают уже загруженный (или загружаемый) документ.
+    Отсутствующий документ запоминается как None, ошибка базы не запоминается.
+    """
+
+    collection: AgnosticCollection
+
+    def __init__(self, collection: AgnosticCollection):
+        self.collection = collection
+        self.memo: Dict[ObjectId, asyncio.Future] = {}
+        self.pending: Dict[ObjectId, asyncio.Future] = {}
+
+    async def load(self, _id: ObjectId) -> Optional[dict]:
+        return (await self.load_many([_id])).get(_id)
+
+    async def load_many(self, _ids: Iterable[ObjectId]) -> Dict[ObjectId, dict]:
+        """Документы по идентификаторам: {_id: документ}, отсутствующих в базе в результате нет"""
+        futures = {_id: self.future(_id) for _id in dict.fromkeys(_ids)}
+        result = {}
+        for _id, future in futures.items():
+            # shield: отмена одного ожидающего не должна отменять загрузку для остальных
+            data = future.result() if future.done() else await asyncio.shield(future)
+            if data is not None:
+                # Копия, чтобы изменения вызывающего кода не попали в общий для запроса документ
+                result[_id] = dict(data)
+        return result
+
+    def future(self, _id: ObjectId) -> asyncio.Future:
+        future = self.memo.get(_id)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            future = self.memo[_id] = loop.create_future()
+            if not self.pending:
+                loop.call_soon(self.dispatch)
+            self.pending[_id] = future
+        return future
+
+    def dispatch(self):
+        batch, self.pending = self.pending, {}
+        asyncio.ensure_future(self.fetch(batch))
+
+    async def fetch(self, batch: Dict[ObjectId, asyncio.Future]):
+        try:
+            found = {data['_id']: data async for data in self.collection.find({'_id': {'$in': list(batch)}})}
+        except Exception as e:
+            for _id, future in batch.items():
+                if self.memo.get(_id) is future:
+                    del self.memo[_id]
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _id, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(_id))
+
+    def prime(self, data: dict):
+        """Запоминает уже загруженный из базы полный документ"""
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(data)
+        self.memo[data['_id']] = future
+
+    def forget(self, _id: Optional[ObjectId] = None):
+        """Забывает документ (или все документы) после изменения в базе"""
+        if _id is None:
+            self.memo.clear()
+        else:
+            self.memo.pop(_id, None)
+
+
+class LoaderRegistry:
+    """Загрузчики запроса: по одному на коллекцию"""
+
+    def __init__(self):
+        self.loaders: Dict[str, EntityLoader] = {}
+
+    def get(self, collection: AgnosticCollection) -> EntityLoader:
+        loader = self.loaders.get(collection.name)
+        if loader is None:
+            loader = self.loaders[collection.name] = EntityLoader(collection)
+        return loader
+
+    def forget(self, collection_name: str, _id: Optional[ObjectId] = None):
+        loader = self.loaders.get(collection_name)
+        if loader is not None:
+            loader.forget(_id)
+
+
+def get_loaders() -> LoaderRegistry:
+    """
+    Загрузчики текущего запроса.
+    Вне запроса (фоновые задачи, скрипты) - новые загрузчики без общей памяти между вызовами.
+    """
+    return LOADERS.get() or LoaderRegistry()
+
+
+def forget(collection_name: str, _id: Optional[ObjectId] = None):
+    """Забывает документ в загрузчиках текущего запроса (вызывается при изменении данных)"""
+    registry = LOADERS.get()
+    if registry is not None:
+        registry.forget(collection_name, _id)
+
+
+class LoaderMiddleware:
+    """ASGI-middleware: создает загрузчики на время HTTP-запроса"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        token = LOADERS.set(LoaderRegistry())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            LOADERS.reset(token)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import queue
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Идентификатор текущего запроса, устанавливается RequestIdMiddleware
+REQUEST_ID: ContextVar[str] = ContextVar('request_id', default='-')
+
+# Стандартные атрибуты LogRecord: все остальные пришли через extra= и попадают в JSON как есть
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+_listener: Optional[QueueListener] = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет к записи идентификатор запроса (в потоке цикла событий, где он известен)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = REQUEST_ID.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+            'location': f'{record.pathname}:{record.lineno}',
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS})
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestIdMiddleware:
+    """ASGI-middleware: берет идентификатор запроса из заголовка или создает новый и возвращает его в ответе"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        header = REQUEST_ID_HEADER.lower().encode()
+        request_id = next((value.decode('latin-1') for name, value in scope['headers'] if name == header), None)
+        request_id = request_id or uuid.uuid4().hex
+        token = REQUEST_ID.set(request_id)
+
+        async def send_with_request_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [(header, request_id.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            REQUEST_ID.reset(token)
+
+
+def init_logging(config: dict):
+    """
+    Настройка логирования приложения.
+
+    Обработчики (файл, stdout) работают в отдельном потоке QueueListener,
+    а в цикле событий запись лишь кладется в очередь.
+    """
+    global _listener
+    stop_logging()
+
+    level = int(config['LOG_LEVEL'])
+    formatter = JsonFormatter()
+    handlers = []
+    if not os.path.exists(config['LOG_DIR']):
+        os.mkdir(config['LOG_DIR'])
+    file_handler = RotatingFileHandler(f'{config["LOG_DIR"]}/service.log', maxBytes=10485760, backupCount=10)
+    handlers.append(file_handler)
+    if config['LOG_TO_STDOUT']:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RequestIdFilter())
+    for logger_name in ('app', 'fastapi'):
+        logger = logging.getLogger(logger_name)
+        logger.setLevel(level)
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Останавливает поток записи логов, дописав накопленные записи"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        for logger_name in ('app', 'fastapi'):
+            logger = logging.getLogger(logger_name)
+            for handler in [h for h in logger.handlers if isinstance(h, QueueHandler)]:
+                logger.removeHandler(handler)
+    _listener = None
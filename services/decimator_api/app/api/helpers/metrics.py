@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+from pymongo import monitoring
+
+# Границы корзин гистограмм длительности в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyWindow:
+    """
+    Скользящее окно последних замеров длительности для расчета перцентилей.
+
+    Хранит не более `size` последних значений (в секундах), поэтому расход памяти
+    постоянный, а перцентили отражают текущую нагрузку, а не всю историю процесса.
+    """
+
+    def __init__(self, *, size: int = 1024):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self, quantiles: Iterable[float] = (0.5, 0.9, 0.99)) -> List[Tuple[float, float]]:
+        """Пары (квантиль, значение в секундах) по текущему окну, методом ближайшего ранга"""
+        samples = sorted(self._samples)
+        result = []
+        for quantile in quantiles:
+            if not samples:
+                result.append((quantile, 0.0))
+                continue
+            rank = min(len(samples) - 1, max(0, int(round(quantile * len(samples))) - 1))
+            result.append((quantile, samples[rank]))
+        return result
+
+    def percentiles(self, quantiles: Iterable[float] = (0.5, 0.9, 0.99)) -> Dict[str, float]:
+        """Перцентили по текущему окну в миллисекундах"""
+        return {f'p{quantile * 100:g}': value * 1000 for quantile, value in self.quantiles(quantiles)}
+
+    def stats(self) -> dict:
+        return {
+            'count': self.count,
+            'avg_ms': self.total / self.count * 1000 if self.count else 0.0,
+            **self.percentiles(),
+        }
+
+
+class Histogram:
+    """
+    Гистограмма длительностей с метками в формате Prometheus.
+
+    Замеры приходят как из цикла событий, так и из потоков драйвера MongoDB, поэтому запись защищена блокировкой.
+    """
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # Структура: {label_values: [counts по корзинам..., sum, count]}
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: Tuple[str, ...], seconds: float):
+        position = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            if position < len(self.buckets):
+                series[position] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series_items = [(key, list(value)) for key, value in self._series.items()]
+        for label_values, series in sorted(series_items):
+            pairs = list(zip(self.labels, label_values))
+            labels = format_labels(pairs)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(pairs, le=f"{bound:g}")} {cumulative}')
+            lines.append(f'{self.name}_bucket{format_labels(pairs, le="+Inf")} {series[-1]}')
+            lines.append(f'{self.name}_sum{labels} {series[-2]}')
+            lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+
+def format_labels(pairs: Iterable[Tuple[str, str]], **extra: str) -> str:
+    items = list(pairs) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+REQUEST_LATENCY = Histogram('decimator_http_request_duration_seconds',
+                            'Длительность обработки HTTP-запросов',
+                            labels=('method', 'route', 'status'))
+MONGO_COMMAND_LATENCY = Histogram('decimator_mongo_command_duration_seconds',
+                                  'Длительность команд MongoDB',
+                                  labels=('collection', 'command', 'status'))
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware, записывающая количество и длительность запросов по шаблону маршрута.
+
+    В метку попадает шаблон пути (`/api/v1/folders/{folder_id}`), а не сам путь,
+    чтобы количество рядов не зависело от идентификаторов в URL.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Dict = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status = {'code': 500}
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_LATENCY.observe((scope['method'], self._route_path(scope), str(status['code'])),
+                                    time.perf_counter() - started)
+
+    def _route_path(self, scope) -> str:
+        route = scope.get('route')
+        if route is not None:
+            return route.path
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        if endpoint not in self._route_paths:
+            for app_route in scope['app'].router.routes:
+                if getattr(app_route, 'endpoint', None) is endpoint:
+                    self._route_paths[endpoint] = app_route.path
+                    break
+            else:
+                self._route_paths[endpoint] = 'unmatched'
+        return self._route_paths[endpoint]
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Записывает длительность и количество команд MongoDB по коллекции и типу команды"""
+
+    def __init__(self):
+        # Структура: {(connection_id, request_id): (collection, command)}
+        self._pending: Dict[tuple, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection')
+        if not isinstance(collection, str):
+            collection = ''
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def succeeded(self, event):
+        self._finish(event, 'ok')
+
+    def failed(self, event):
+        self._finish(event, 'failed')
+
+    def _finish(self, event, status: str):
+        with self._lock:
+            collection, command = self._pending.pop((event.connection_id, event.request_id),
+                                                    ('', event.command_name))
+        MONGO_COMMAND_LATENCY.observe((collection, command, status), event.duration_micros / 1e6)
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    """
+    Состояние пула соединений MongoDB по адресам серверов: открытые и выданные соединения
+    и время ожидания выдачи соединения.
+
+    Выдача соединения выполняется синхронно в потоке драйвера (Motor запускает операции
+    в пуле потоков), поэтому начало ожидания хранится в threading.local.
+    """
+
+    def __init__(self):
+        self.max_size = 0
+        self.open: Dict[str, int] = {}
+        self.checked_out: Dict[str, int] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _address(event) -> str:
+        host, port = event.address
+        return f'{host}:{port}'
+
+    def _add(self, counters: Dict[str, int], event, delta: int):
+        address = self._address(event)
+        with self._lock:
+            counters[address] = counters.get(address, 0) + delta
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        address = self._address(event)
+        with self._lock:
+            self.open.pop(address, None)
+            self.checked_out.pop(address, None)
+
+    def connection_created(self, event):
+        self._add(self.open, event, 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(self.open, event, -1)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        # reason: timeout (истек waitQueueTimeoutMS), poolClosed или connectionError
+        self._observe_wait(event, str(event.reason))
+
+    def connection_checked_out(self, event):
+        self._add(self.checked_out, event, 1)
+        self._observe_wait(event, 'ok')
+
+    def connection_checked_in(self, event):
+        self._add(self.checked_out, event, -1)
+
+    def _observe_wait(self, event, status: str):
+        started = getattr(self._local, 'started', None)
+        if started is not None:
+            self._local.started = None
+            MONGO_POOL_WAIT.observe((self._address(event), status), time.perf_counter() - started)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            gauges = (('connections', 'Открытые соединения пула MongoDB', dict(self.open)),
+                      ('checked_out', 'Выданные (занятые) соединения пула MongoDB', dict(self.checked_out)))
+        lines = ['# HELP decimator_mongo_pool_max_size Максимальный размер пула соединений MongoDB (на процесс)',
+                 '# TYPE decimator_mongo_pool_max_size gauge',
+                 f'decimator_mongo_pool_max_size {self.max_size}']
+        for name, description, values in gauges:
+            metric = f'decimator_mongo_pool_{name}'
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} gauge']
+            lines += [f'{metric}{format_labels([("address", address)])} {value}'
+                      for address, value in sorted(values.items())]
+        return lines + MONGO_POOL_WAIT.render()
+
+
+# Ожидание соединения обычно меньше миллисекунды, поэтому корзины мельче стандартных
+MONGO_POOL_WAIT = Histogram('decimator_mongo_pool_wait_seconds',
+                            'Ожидание выдачи соединения из пула MongoDB',
+                            labels=('address', 'status'),
+                            buckets=(0.0001, 0.0005) + DEFAULT_BUCKETS)
+MONGO_POOL = MongoPoolListener()
+
+
+def render_metrics(*, caches: Dict[str, object], latencies: Dict[str, LatencyWindow]) -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    lines = REQUEST_LATENCY.render() + MONGO_COMMAND_LATENCY.render() + MONGO_POOL.render()
+
+    cache_stats = {name: cache.stats() for name, cache in caches.items()}
+    for field, metric_type, description in (('hits', 'counter', 'Попадания в кэш'),
+                                            ('misses', 'counter', 'Промахи кэша'),
+                                            ('evictions', 'counter', 'Вытеснения из кэша'),
+                                            ('expirations', 'counter', 'Устаревшие записи кэша'),
+                                            ('entries', 'gauge', 'Записей в кэше'),
+                                            ('bytes', 'gauge', 'Приблизительный объем кэша в байтах'),
+                                            ('hit_ratio', 'gauge', 'Доля попаданий в кэш')):
+        name = f'decimator_cache_{field}_total' if metric_type == 'counter' else f'decimator_cache_{field}'
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+        lines += [f'{name}{format_labels([("cache", cache_name)])} {stats[field]}'
+                  for cache_name, stats in cache_stats.items()]
+
+    for name, window in latencies.items():
+        metric = f'decimator_{name}_duration_seconds'
+        lines += [f'# TYPE {metric} summary']
+        lines += [f'{metric}{format_labels([], quantile=f"{quantile:g}")} {value}'
+                  for quantile, value in window.quantiles()]
+        lines += [f'{metric}_sum {window.total}', f'{metric}_count {window.count}']
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import bcrypt
+from fastapi import HTTPException
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+
+from app.api.helpers.metrics import LatencyWindow
+
+# bcrypt намеренно медленный (десятки-сотни миллисекунд на вызов), поэтому хэширование
+# выполняется в отдельном пуле потоков, а не в цикле событий. Семафор ограничивает
+# количество одновременно ожидающих операций, чтобы всплеск входов не занимал весь пул надолго.
+BCRYPT_ROUNDS = 12
+HASH_WORKERS = 4
+HASH_CONCURRENCY = 16
+# Сколько секунд запрос может ждать своей очереди, прежде чем получить 503
+HASH_QUEUE_TIMEOUT = 10
+
+LOGIN_LATENCY = LatencyWindow()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def configure(config: dict):
+    """Применяет настройки хэширования паролей из конфигурации (вызывается при запуске приложения)"""
+    global BCRYPT_ROUNDS, HASH_WORKERS, HASH_CONCURRENCY, HASH_QUEUE_TIMEOUT
+    BCRYPT_ROUNDS = int(config['BCRYPT_ROUNDS'])
+    HASH_WORKERS = int(config['PASSWORD_HASH_WORKERS'])
+    HASH_CONCURRENCY = int(config['PASSWORD_HASH_CONCURRENCY'])
+    HASH_QUEUE_TIMEOUT = float(config['PASSWORD_HASH_QUEUE_TIMEOUT'])
+    shutdown()
+
+
+def shutdown():
+    global _executor, _semaphore
+    if _executor:
+        _executor.shutdown(wait=False)
+    _executor = None
+    _semaphore = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='bcrypt')
+    return _executor
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(HASH_CONCURRENCY)
+    return _semaphore
+
+
+async def _run(func, *args):
+    semaphore = _get_semaphore()
+    # Ожидание очереди - через отдельную задачу, а не wait_for: в Python < 3.11 wait_for может потерять
+    # завершившийся acquire при отмене, и место в семафоре не освободится никогда.
+    # Место освобождается, только если acquire действительно завершился
+    acquire = asyncio.ensure_future(semaphore.acquire())
+    try:
+        done, _ = await asyncio.wait([acquire], timeout=HASH_QUEUE_TIMEOUT)
+    except asyncio.CancelledError:
+        if not acquire.cancel():
+            semaphore.release()
+        raise
+    if not done:
+        acquire.cancel()
+        raise HTTPException(status_code=HTTP_503_SERVICE_UNAVAILABLE,
+                            detail='Сервер перегружен, повторите попытку позже')
+    try:
+        return await asyncio.get_event_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        semaphore.release()
+
+
+def _hash(password: bytes, rounds: int) -> Tuple[bytes, bytes]:
+    salt = bcrypt.gensalt(rounds=rounds)
+    return bcrypt.hashpw(password, salt), salt
+
+
+async def hash_password(password: str) -> Tuple[bytes, bytes]:
+    """Хэш и соль пароля"""
+    return await _run(_hash, password.encode(), BCRYPT_ROUNDS)
+
+
+async def check_password(password: str, pwd_hash: bytes) -> bool:
+    return await _run(bcrypt.checkpw, password.encode(), pwd_hash)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+from functools import lru_cache
+from typing import Any, Callable, Optional, Type
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST
+from starlette.responses import JSONResponse
+
+from app.api.models.dbmodel import mongo_json_default
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него используется стандартный json
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """JSON-байты для ответа: ObjectId и datetime кодируются так же, как DBModel.Config.json_encoders"""
+    if orjson is not None:
+        return orjson.dumps(content, default=mongo_json_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':'),
+                      default=mongo_json_default).encode('utf-8')
+
+
+def opaque_tag(tag: str) -> str:
+    """ETag без признака слабости: для If-None-Match W/"x" и "x" считаются одинаковыми"""
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Совпадает ли ETag с заголовком If-None-Match (список через запятую или *)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or opaque_tag(etag) in map(opaque_tag, tags)
+
+
+class MongoJSONResponse(JSONResponse):
+    """
+    Ответ из уже подготовленных словарей MongoDB без проверки response_model.
+
+    FastAPI не валидирует и не прогоняет через jsonable_encoder возвращенный Response,
+    поэтому строки списка кодируются в JSON один раз. Форму строк задает row_shaper.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+@lru_cache(maxsize=None)
+def row_shaper(model: Type[BaseModel]) -> Callable[[dict], dict]:
+    """
+    Функция, приводящая сырой документ MongoDB к полям модели ответа без валидации.
+
+    Оставляет только поля модели (по алиасам, так же как response_model), подставляет
+    значения по умолчанию для отсутствующих полей и рекурсивно обрабатывает вложенные модели.
+    """
+    spec = []
+    for field in model.__fields__.values():
+        nested = field.type_ if isinstance(field.type_, type) and issubclass(field.type_, BaseModel) else None
+        spec.append((field.alias, field.default, row_shaper(nested) if nested else None, field.shape == SHAPE_LIST))
+
+    def shape(doc: dict) -> dict:
+        row = {}
+        for alias, default, nested_shape, is_list in spec:
+            value = doc.get(alias, default)
+            if nested_shape is not None and value is not None:
+                if is_list:
+                    value = [nested_shape(item) for item in value]
+                else:
+                    value = nested_shape(value.dict(by_alias=True) if isinstance(value, BaseModel) else value)
+            row[alias] = value
+        return row
+
+    return shape
@@ -66,3 +66,11 @@ class DBModel(BaseModel):
             datetime: lambda dt: dt.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z"),
             ObjectId: lambda oid: str(oid),
         }
+
+
+def mongo_json_default(value):
+    """`default` для json.dumps: кодирует ObjectId и datetime так же, как DBModel.Config.json_encoders"""
+    encoder = DBModel.Config.json_encoders.get(type(value))
+    if encoder is None:
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+    return encoder(value)
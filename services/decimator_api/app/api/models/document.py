@@ -36,3 +36,10 @@ class DocumentInfo(DocumentDB):
 
 class DocumentWithAuthor(DocumentInfo):
     authorFullName: UserUpdate
+
+
+class DocumentBulkResult(DBModel):
+    index: int
+    status_code: int
+    id: Optional[OID] = None
+    detail: Optional[str] = None
@@ -1,13 +1,33 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import Optional, List
+import asyncio
+import copy
+from typing import Awaitable, Dict, Iterable, Optional, List
 
 from motor.core import AgnosticDatabase, AgnosticCollection
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from app.api.helpers.loaders import EntityLoader, get_loaders
 from app.api.models.dbmodel import DBModel
 from app.api.models.types import OID
 from app.api.models.user import UserInfo
+from app.api.services.hierarchy import OrgAccess
+
+
+async def gather_independent(*aws: Awaitable) -> tuple:
+    """
+    Выполняет независимые друг от друга операции параллельно и возвращает их результаты в порядке аргументов.
+
+    Операции могут быть и чтениями, и записями: повторов нет, и при ошибке одной из них
+    остальные все равно выполняются до конца (их изменения в базе остаются). Дожидается завершения
+    всех операций; если какие-то из них завершились ошибкой, поднимает ошибку первой из них
+    по порядку аргументов - ту же, что и при последовательном выполнении.
+    """
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return tuple(results)
 
 
 class BaseManager:
@@ -29,23 +49,60 @@ class BaseManager:
         self.db_client = db.client
         self.collection = db.client[self.config['MONGO_DB']][self.collection_name]
 
+    def can_write(self, access: Optional[OrgAccess]) -> bool:
+        """Может ли текущий пользователь изменять данные организации с указанными правами доступа"""
+        return self.who.isSuper or (access is not None and self.who.id in access.can_write)
+
+    def for_user(self, who: Optional[UserInfo]) -> 'BaseManager':
+        """
+        Копия менеджера для пользователя запроса.
+        Менеджеры создаются один раз при запуске (см. Managers), на запрос меняется только who.
+        """
+        manager = copy.copy(self)
+        manager.who = who
+        return manager
+
+    @property
+    def loader(self) -> EntityLoader:
+        """Загрузчик документов коллекции по _id в рамках текущего запроса"""
+        return get_loaders().get(self.collection)
+
+    def forget(self, _id: Optional[OID] = None):
+        """Забывает загруженный в рамках запроса документ после его изменения"""
+        self.loader.forget(_id)
+
     async def create_new(self, new_data: DBModel) -> DBModel:
         raise NotImplemented
 
     async def get_data_by_id(self, _id: OID) -> dict:
-        return await self.collection.find_one({'_id': _id})
+        return await self.loader.load(_id)
 
     async def get_active_data_by_id(self, _id: OID) -> dict:
-        return await self.collection.find_one({'_id': _id, 'isActive': True})
+        data = await self.loader.load(_id)
+        return data if data and data.get('isActive') is True else None
 
     async def is_entity_available(self, *, fields_filter: dict) -> bool:
         return False if await self.collection.find_one({**fields_filter, 'isActive': True}) else True
 
-    async def ensure_existance(self, *, _ids: List[OID]) -> bool:
-        result = True
-        for _id in _ids:
-            data = await self.get_data_by_id(_id)
-            if not data:
-                result = False
-                break
-        return result
+    async def get_many_by_ids(self, _ids: Iterable[OID], *, projection: Optional[dict] = None) -> Dict[OID, dict]:
+        """
+        Документы по списку идентификаторов одним запросом с $in.
+        Полные документы загружаются через загрузчик запроса, с проекцией - напрямую.
+
+        :return: {_id: документ}; отсутствующих в базе идентификаторов в результате нет
+        """
+        _ids = list(dict.fromkeys(_ids))
+        if not _ids:
+            return {}
+        if projection is None:
+            return await self.loader.load_many(_ids)
+        return {data['_id']: data async for data in self.collection.find({'_id': {'$in': _ids}}, projection=projection)}
+
+    async def find_missing_ids(self, *, _ids: Iterable[OID]) -> List[OID]:
+        """Идентификаторы из списка, которых нет в коллекции (в порядке списка, без повторов)"""
+        _ids = list(dict.fromkeys(_ids))
+        existing = await self.get_many_by_ids(_ids, projection={'_id': 1})
+        return [_id for _id in _ids if _id not in existing]
+
+    async def ensure_existance(self, *, _ids: Iterable[OID]) -> bool:
+        return not await self.find_missing_ids(_ids=_ids)
@@ -1,30 +1,65 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import Optional, List, Dict
-import time
 import asyncio
-from datetime import datetime, timedelta
+import base64
+import binascii
+import csv
+import io
+import json
+import logging
+from typing import Optional, List, Tuple, AsyncIterator, NamedTuple, Iterable
 
+from bson import ObjectId
+from bson.errors import InvalidId
 from fastapi import HTTPException
 from motor.core import AgnosticDatabase, AgnosticCollection
+from pymongo.errors import OperationFailure, PyMongoError, BulkWriteError
 from pymongo.results import InsertOneResult
-from starlette.status import HTTP_409_CONFLICT, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_403_FORBIDDEN
+from starlette.status import HTTP_409_CONFLICT, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_403_FORBIDDEN, \
+    HTTP_201_CREATED
 
-from app.api.models.document import DocumentInfo, DocumentDB, Document, DocumentWithAuthor, DocumentUpdate
-from app.api.models.folder import Folder, FolderInfo
-from app.api.models.folder_group import FolderGroupInfo
-from app.api.models.org import OrgInfo
+from app.api.helpers.cache import TTLCache
+from app.api.helpers.responses import row_shaper, dumps, etag_matches
+from app.api.models.dbmodel import mongo_json_default
+from app.api.models.document import DocumentInfo, DocumentDB, Document, DocumentWithAuthor, DocumentUpdate, \
+    DocumentBulkResult
 from app.api.models.types import OID
 from app.api.models.user import UserInfo, UserUpdate
-from app.api.services.base import BaseManager
-from app.api.services.users import UserManager
+from app.api.services.base import BaseManager, gather_independent
+from app.api.services.folders import FolderManager, RESERVES_CACHE, NUMBER_ALLOCATORS
+from app.api.services.hierarchy import HierarchyIndex, ORG_ACCESS
+from app.api.services.orgs import OrgManager, ORGS_CACHE
+from app.api.services.projects import ProjectIndex, PROJECT_COUNTED
+from app.api.services.users import UserManager, USERS_CACHE
+
+logger = logging.getLogger(__name__)
 
-# Глобальный кэш для документов и проектов
-# Структура: {'folder_id': {'documents': [...], 'timestamp': time.time(), 'projects': [...]}}
-DOCUMENTS_CACHE: Dict[str, Dict] = {}
 # Время жизни кэша в секундах
 CACHE_TTL = 60  # 1 минута
 
+# Глобальный кэш для документов и проектов с ограничением по количеству записей и объему
+# Ключи: ('documents', folder_id) - FolderListing папки, ('projects', folder_id) - список проектов папки
+DOCUMENTS_CACHE = TTLCache(maxsize=256, maxbytes=64 * 1024 * 1024, ttl=CACHE_TTL)
+# Колонки CSV-выгрузки документов
+EXPORT_CSV_COLUMNS = ['folder', 'number', 'version', 'project', 'comment', 'author', 'created', 'id']
+# Пауза перед переподключением к change stream после сетевой ошибки (в секундах)
+CACHE_WATCHER_RETRY_DELAY = 5
+# Коды ошибок MongoDB без поддержки change streams (standalone-сервер, не replica set)
+CHANGE_STREAMS_UNSUPPORTED_CODES = {40573, 40324}
+# Кэши, которые сбрасываются по событиям каждой из отслеживаемых коллекций
+WATCHED_CACHES = {
+    'docs': (DOCUMENTS_CACHE, NUMBER_ALLOCATORS),
+    'folders': (DOCUMENTS_CACHE, RESERVES_CACHE),
+    'orgs': (ORG_ACCESS, ORGS_CACHE),
+    'users': (USERS_CACHE,),
+}
+
+
+class FolderListing(NamedTuple):
+    """Закэшированный список документов папки: версия папки (docsVersion) и JSON-фрагменты документов по порядку номеров"""
+    version: int
+    fragments: List[bytes]
+
 
 class DocumentManager(BaseManager):
     entity_name: str = 'Document'
@@ -34,46 +69,64 @@ class DocumentManager(BaseManager):
     db_info_model = DocumentDB
 
     folder_collection: AgnosticCollection
-    fg_collection: AgnosticCollection
-    org_collection: AgnosticCollection
     user_collection: AgnosticCollection
+    folder_manager: FolderManager
+    user_manager: UserManager
+    hierarchy: HierarchyIndex
+    projects: ProjectIndex
 
     def __init__(self, *, config: dict, db: AgnosticDatabase, who: Optional[UserInfo] = None):
         super().__init__(config=config, db=db, who=who)
+        self.folder_manager = FolderManager(config=config, db=db, who=who)
+        self.user_manager = UserManager(config=config, db=db)
+        self.hierarchy = HierarchyIndex(config=config, db=db)
+        self.projects = ProjectIndex(config=config, db=db)
         self.folder_collection = db.client[self.config['MONGO_DB']]['folders']
-        self.org_collection = db.client[self.config['MONGO_DB']]['orgs']
-        self.fg_collection = db.client[self.config['MONGO_DB']]['folder_groups']
         self.user_collection = db.client[self.config['MONGO_DB']]['users']
 
-    async def get_org(self, *, folder_id: OID) -> OrgInfo:
-        db_folder = await self.folder_collection.find_one({'_id': folder_id})
-        folder = FolderInfo(**db_folder)
-        db_fg = await self.fg_collection.find_one({'_id': folder.folderGroupId})
-        fg = FolderGroupInfo(**db_fg)
-        db_org = await self.org_collection.find_one({'_id': fg.orgId})
-        return OrgInfo(**db_org)
+    def for_user(self, who: Optional[UserInfo]) -> 'DocumentManager':
+        manager = super().for_user(who)
+        manager.folder_manager = self.folder_manager.for_user(who)
+        return manager
+
+    @staticmethod
+    def configure_cache(config: dict):
+        """Применяет настройки кэша документов из конфигурации"""
+        DOCUMENTS_CACHE.configure(maxsize=config['DOCUMENTS_CACHE_SIZE'],
+                                  maxbytes=config['DOCUMENTS_CACHE_MAX_BYTES'],
+                                  ttl=config['DOCUMENTS_CACHE_TTL'])
 
     async def create_new(self, *, new_data: Document) -> DocumentWithAuthor:
-        if not await self.is_entity_available(fields_filter={'folderId': new_data.folderId, 
-                                                             'version': new_data.version, 
-                                                             'number': new_data.number}):
+        # Проверки независимы и выполняются одним параллельным обращением к базе
+        is_available, is_reserved, access, is_claimed = await gather_independent(
+            self.is_entity_available(fields_filter={'folderId': new_data.folderId,
+                                                    'version': new_data.version,
+                                                    'number': new_data.number}),
+            self.folder_manager.is_number_reserved(folder_id=new_data.folderId, number=new_data.number),
+            self.hierarchy.get_folder_access(new_data.folderId),
+            self.folder_manager.is_claimed_by_other(folder_id=new_data.folderId, number=new_data.number),
+        )
+        if not is_available:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Схожий документ уже существует')
-        db_folder = await self.folder_collection.find_one({'_id': new_data.folderId})
-        if not db_folder:
+        if is_reserved is None:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Такой папки не существует...')
-        folder = Folder(**db_folder)
-        org = await self.get_org(folder_id=new_data.folderId)
-        if not self.who.isSuper and self.who.id not in org.canWrite:
+        if not self.can_write(access):
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав создавать документы')
-        for reserve in folder.reserves:
-            if reserve.from_ <= new_data.number <= reserve.to_:
-                raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Указанный номер зарезервирован...')
-        new_db_document: InsertOneResult = await self.collection.insert_one(DocumentDB(**new_data.mongo()).mongo())
+        if is_reserved:
+            raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Указанный номер зарезервирован...')
+        if is_claimed:
+            raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Указанный номер захвачен другим пользователем')
+        new_db_document: InsertOneResult = await self.collection.insert_one({**DocumentDB(**new_data.mongo()).mongo(),
+                                                                             PROJECT_COUNTED: True})
         if not new_db_document:
             raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось создать документ =(')
             
-        # Инвалидируем кэш для папки
-        self.invalidate_cache_for_folder(new_data.folderId)
+        FolderManager.track_document_number(new_data.folderId, new_db_document.inserted_id, added=new_data.number)
+        await gather_independent(
+            self.touch_folders([new_data.folderId]),
+            self.projects.track([(new_data.folderId, new_data.project, 1)]),
+            self.folder_manager.release_claims(folder_id=new_data.folderId, numbers=[new_data.number]),
+        )
         
         return DocumentWithAuthor(**new_data.dict(),
                                   id=new_db_document.inserted_id,
@@ -82,166 +135,441 @@ class DocumentManager(BaseManager):
     async def update(self, *, doc_id: OID, new_data: DocumentUpdate) -> DocumentWithAuthor:
         db_doc = await self.get_data_by_id(doc_id)
         doc = DocumentInfo(**db_doc)
-        if not await self.is_entity_available(fields_filter={'_id': {'$ne': doc_id},
-                                                             'folderId': doc.folderId,
-                                                             'version': new_data.version,
-                                                             'number': new_data.number}):
+        # Все проверки зависят только от самого документа: второе обращение к базе - параллельное
+        is_available, is_reserved, access, authors, is_claimed = await gather_independent(
+            self.is_entity_available(fields_filter={'_id': {'$ne': doc_id},
+                                                    'folderId': doc.folderId,
+                                                    'version': new_data.version,
+                                                    'number': new_data.number}),
+            self.folder_manager.is_number_reserved(folder_id=doc.folderId, number=new_data.number),
+            self.hierarchy.get_folder_access(doc.folderId),
+            self.user_manager.get_authors(user_ids=[doc.authorId]),
+            self.folder_manager.is_claimed_by_other(folder_id=doc.folderId, number=new_data.number),
+        )
+        if not is_available:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Схожий документ уже существует')
-        db_folder = await self.folder_collection.find_one({'_id': doc.folderId})
-        if not db_folder:
+        if is_reserved is None:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Такой папки не существует...')
-        folder = Folder(**db_folder)
-        org = await self.get_org(folder_id=doc.folderId)
-        if not self.who.isSuper and self.who.id not in org.canWrite:
+        if not self.can_write(access):
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав обновлять документы')
         if not self.who.isSuper and self.who.id != doc.authorId:
             raise HTTPException(status_code=HTTP_403_FORBIDDEN,
                                 detail='Только администраторы и авторы могут обновлять документы')
-        for reserve in folder.reserves:
-            if reserve.from_ <= new_data.number <= reserve.to_:
-                raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Указанный номер зарезервирован...')
-        await self.collection.update_one({'_id': doc_id}, {'$set': new_data.mongo()})
+        if is_reserved:
+            raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Указанный номер зарезервирован...')
+        if is_claimed:
+            raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Указанный номер захвачен другим пользователем')
+        # Прежний документ возвращается той же записью: по нему видно, учтен ли его проект в индексе
+        old_db_doc = await self.collection.find_one_and_update(
+            {'_id': doc_id},
+            {'$set': {**new_data.mongo(), PROJECT_COUNTED: True}},
+            projection={'project': 1, PROJECT_COUNTED: 1},
+        )
+        self.forget(doc_id)
         
-        # Инвалидируем кэш для папки
-        self.invalidate_cache_for_folder(doc.folderId)
+        # Версия папки, захваты номеров и индекс проектов не зависят друг от друга - обновляются параллельно
+        writes = [self.touch_folders([doc.folderId])]
+        if new_data.number != doc.number:
+            FolderManager.track_document_number(doc.folderId, doc_id, added=new_data.number, removed=doc.number)
+            writes.append(self.folder_manager.release_claims(folder_id=doc.folderId, numbers=[new_data.number]))
+        if old_db_doc:
+            changes = [(doc.folderId, new_data.project, 1)]
+            if old_db_doc.get(PROJECT_COUNTED):
+                changes.append((doc.folderId, old_db_doc.get('project'), -1))
+            writes.append(self.projects.track(changes))
+        await gather_independent(*writes)
         
-        db_author = await self.user_collection.find_one({'_id': doc.authorId})
-        author = UserUpdate(**db_author)
-        return DocumentWithAuthor(**{**doc.mongo(), **new_data.mongo(), 'authorFullName': author})
+        return DocumentWithAuthor(**{**doc.mongo(), **new_data.mongo(), 'authorFullName': authors[doc.authorId]})
+
+    async def create_many(self, *, new_docs: List[Document]) -> List[DocumentBulkResult]:
+        """
+        Пакетное создание документов.
+
+        Папки, группы папок и организации загружаются одним запросом на коллекцию,
+        конфликты номеров/версий проверяются одним запросом с $in, вставка - одним insert_many.
+        Возвращает результат для каждого документа в порядке запроса.
+        """
+        results = {}
+
+        def reject(index: int, status_code: int, detail: str):
+            results[index] = DocumentBulkResult(index=index, status_code=status_code, detail=detail)
+
+        folder_ids = list({doc.folderId for doc in new_docs})
+        reserve_indexes = {}
+        folders = await self.folder_manager.get_many_by_ids(folder_ids, projection={'folderGroupId': 1,
+                                                                                    'reserves.from_': 1,
+                                                                                    'reserves.to_': 1})
+        for db_folder in folders.values():
+            reserve_indexes[db_folder['_id']] = FolderManager.cache_reserve_index(db_folder)
+            HierarchyIndex.cache_folder(db_folder)
+        # Права доступа - по одной проверке на группу папок (обычно из кэша иерархии)
+        access_by_fg = {}
+        for fg_id in {db_folder['folderGroupId'] for db_folder in folders.values()}:
+            access_by_fg[fg_id] = await self.hierarchy.get_folder_group_access(fg_id)
+
+        # Уже существующие документы с теми же номерами в тех же папках
+        taken = set()
+        numbers_by_folder = {}
+        for doc in new_docs:
+            numbers_by_folder.setdefault(doc.folderId, set()).add(doc.number)
+        if numbers_by_folder:
+            conflicts_filter = {'$or': [{'folderId': folder_id, 'number': {'$in': list(numbers)}}
+                                        for folder_id, numbers in numbers_by_folder.items()]}
+            async for db_doc in self.collection.find(conflicts_filter,
+                                                     projection={'folderId': 1, 'number': 1, 'version': 1}):
+                taken.add((db_doc['folderId'], db_doc['number'], db_doc.get('version', '')))
+        claimed = await self.folder_manager.get_numbers_claimed_by_others(numbers_by_folder=numbers_by_folder)
+
+        to_insert = []
+        for index, doc in enumerate(new_docs):
+            folder = folders.get(doc.folderId)
+            if not folder:
+                reject(index, HTTP_409_CONFLICT, 'Такой папки не существует...')
+                continue
+            if not self.can_write(access_by_fg[folder['folderGroupId']]):
+                reject(index, HTTP_403_FORBIDDEN, 'Нет прав создавать документы')
+                continue
+            key = (doc.folderId, doc.number, doc.version)
+            if key in taken:
+                reject(index, HTTP_409_CONFLICT, 'Схожий документ уже существует')
+                continue
+            if doc.number in reserve_indexes[doc.folderId]:
+                reject(index, HTTP_409_CONFLICT, 'Указанный номер зарезервирован...')
+                continue
+            if (doc.folderId, doc.number) in claimed:
+                reject(index, HTTP_409_CONFLICT, 'Указанный номер захвачен другим пользователем')
+                continue
+            # Дубликаты внутри самого пакета тоже считаются конфликтом
+            taken.add(key)
+            to_insert.append((index, {**DocumentDB(**doc.mongo()).mongo(), PROJECT_COUNTED: True}))
+
+        if to_insert:
+            failed = {}
+            try:
+                await self.collection.insert_many([db_doc for _, db_doc in to_insert], ordered=False)
+            except BulkWriteError as e:
+                failed = {error['index']: error.get('errmsg', '') for error in e.details.get('writeErrors', [])}
+            for position, (index, db_doc) in enumerate(to_insert):
+                if position in failed:
+                    reject(index, HTTP_400_BAD_REQUEST, 'Не удалось создать документ =(')
+                else:
+                    # insert_many проставляет _id в переданные словари
+                    results[index] = DocumentBulkResult(index=index, status_code=HTTP_201_CREATED, id=db_doc['_id'])
+                    FolderManager.track_document_number(db_doc['folderId'], db_doc['_id'], added=db_doc['number'])
+
+            # Версия и кэш меняются один раз для каждой затронутой папки
+            await self.touch_folders({db_doc['folderId'] for _, db_doc in to_insert})
+            created_numbers = {}
+            for position, (_, db_doc) in enumerate(to_insert):
+                if position not in failed:
+                    created_numbers.setdefault(db_doc['folderId'], []).append(db_doc['number'])
+            for folder_id, numbers in created_numbers.items():
+                await self.folder_manager.release_claims(folder_id=folder_id, numbers=numbers)
+            await self.projects.track((db_doc['folderId'], db_doc.get('project'), 1)
+                                      for position, (_, db_doc) in enumerate(to_insert) if position not in failed)
+
+        return [results[index] for index in range(len(new_docs))]
 
     async def is_entity_available(self, *, fields_filter: dict) -> bool:
         copy = await self.collection.find_one(fields_filter)
         return False if copy else True
 
-    async def get_documents(self, *, folder_id: OID, um: UserManager, limit: int = 100, skip: int = 0) -> List[DocumentWithAuthor]:
-        """Оптимизированный метод получения документов с пагинацией и предзагруженными данными пользователей"""
+    async def get_documents(self, *,
+                            folder_id: OID,
+                            um: UserManager,
+                            limit: int = 100,
+                            skip: int = 0,
+                            if_none_match: Optional[str] = None) -> Tuple[Optional[bytes], str]:
+        """
+        Получение страницы документов папки в виде готового JSON-массива.
+
+        ETag страницы строится по версии папки (docsVersion), которая хранится в MongoDB и
+        увеличивается при каждом изменении документов папки, поэтому он одинаков во всех воркерах.
+        Если ETag совпал с if_none_match, документы не читаются и вместо тела возвращается None.
+        Список папки кэшируется как закодированные JSON-фрагменты документов вместе с версией;
+        список другой версии (папку изменил другой воркер) собирается заново.
+        """
         folder_id_str = str(folder_id)
-        
-        # Проверяем наличие данных в кэше
-        if folder_id_str in DOCUMENTS_CACHE and 'documents' in DOCUMENTS_CACHE[folder_id_str]:
-            cache_entry = DOCUMENTS_CACHE[folder_id_str]
-            cache_time = cache_entry.get('timestamp', 0)
-            
-            # Проверяем, не устарел ли кэш
-            if time.time() - cache_time < CACHE_TTL:
-                print(f"Используем кэшированные документы для папки {folder_id_str}")
-                # Применяем пагинацию к кэшированным данным
-                cached_docs = cache_entry['documents']
-                return cached_docs[skip:skip+limit]
-        
-        # Если кэша нет или он устарел, выполняем запрос к базе данных
-        # Используем агрегацию для объединения документов и пользователей
-        pipeline = [
-            # Этап 1: Фильтрация по folderId
-            {"$match": {"folderId": folder_id}},
-            
-            # Этап 2: Сортировка по number для оптимизации производительности
-            {"$sort": {"number": 1}},
-            
-            # Этап 3: Опционально применяем пагинацию для оптимизации
-            # Если limit большой, загружаем все для кэширования
-            {"$skip": 0 if limit > 100 else skip},
-            {"$limit": 1000 if limit > 100 else limit},  # Ограничиваем макс. 1000 документов для кэша
-            
-            # Этап 4: Объединяем с коллекцией пользователей для получения данных автора
-            {"$lookup": {
-                "from": "users",
-                "localField": "authorId",
-                "foreignField": "_id",
-                "as": "author"
-            }},
-            
-            # Этап 5: Разворачиваем массив author
-            {"$unwind": "$author"},
-            
-            # Этап 6: Проекция полей для оптимизации данных
-            {"$project": {
-                "_id": 1,
-                "authorId": 1,
-                "folderId": 1,
-                "project": 1,
-                "comment": 1,
-                "number": 1,
-                "version": 1,
-                "created": 1,
-                "authorFullName": {
-                    "firstName": "$author.firstName",
-                    "secondName": "$author.secondName",
-                    "lastName": "$author.lastName"
-                }
-            }}
-        ]
-        
-        # Выполняем агрегацию
-        result = []
-        async for doc in self.collection.aggregate(pipeline):
-            # Конвертируем результат в модель DocumentWithAuthor
-            result.append(DocumentWithAuthor(**doc))
-        
-        # Сохраняем результат в кэш
-        if limit > 100:  # Кэшируем только при запросе большого количества документов
-            DOCUMENTS_CACHE[folder_id_str] = {
-                'documents': result,
-                'timestamp': time.time()
-            }
-            
-            # Если нужно пагинировать кэшированные данные
-            return result[skip:skip+limit]
-        
-        return result
-        
+        # Версия читается до документов: страница не может оказаться старше своего ETag
+        db_folder = await self.folder_collection.find_one({'_id': folder_id}, projection={'docsVersion': 1})
+        version = (db_folder or {}).get('docsVersion', 0)
+        etag = f'W/"{version}-{skip}-{limit}"'
+        if etag_matches(if_none_match, etag):
+            return None, etag
+
+        # Проверяем наличие данных в кэше (устаревшие записи кэш отбрасывает сам)
+        listing = DOCUMENTS_CACHE.get(('documents', folder_id_str))
+        if listing is not None and listing.version == version:
+            logger.debug("Используем кэшированные документы для папки %s", folder_id_str)
+        else:
+            # Простой find по индексу (folderId, number) с сортировкой по number
+            db_docs = self.collection.find({"folderId": folder_id}).sort("number", 1)
+            if limit <= 100:
+                rows = await self.join_authors(db_docs=[doc async for doc in db_docs.skip(skip).limit(limit)], um=um)
+                return dumps(rows), etag
+            # Если limit большой, загружаем все для кэширования (не больше 1000 документов)
+            rows = await self.join_authors(db_docs=[doc async for doc in db_docs.limit(1000)], um=um)
+            listing = FolderListing(version=version, fragments=[dumps(row) for row in rows])
+            DOCUMENTS_CACHE.set(('documents', folder_id_str), listing)
+
+        return b'[' + b','.join(listing.fragments[skip:skip + limit]) + b']', etag
+
+    @staticmethod
+    async def join_authors(*, db_docs: List[dict], um: UserManager) -> List[dict]:
+        """
+        Добавляет к документам ФИО авторов из кэша авторов (за один проход, без $lookup).
+        Документы, автор которых не найден, пропускаются - как при $lookup + $unwind.
+        Возвращает строки в форме DocumentWithAuthor, готовые для MongoJSONResponse.
+        """
+        authors = await um.get_authors(user_ids=[doc['authorId'] for doc in db_docs])
+        author_rows = {author_id: author.dict() for author_id, author in authors.items()}
+        shape = row_shaper(DocumentWithAuthor)
+        rows = []
+        for doc in db_docs:
+            if doc['authorId'] in author_rows:
+                doc['authorFullName'] = author_rows[doc['authorId']]
+                rows.append(shape(doc))
+        return rows
+
+    @staticmethod
+    def encode_cursor(doc: dict) -> str:
+        """Непрозрачный курсор на позицию после документа: (number, _id)"""
+        return base64.urlsafe_b64encode(f'{doc["number"]}:{doc["_id"]}'.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[int, ObjectId]:
+        try:
+            number, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+            return int(number), ObjectId(doc_id)
+        except (ValueError, binascii.Error, InvalidId):
+            raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Неверный курсор')
+
+    async def get_documents_after(self, *,
+                                  folder_id: OID,
+                                  um: UserManager,
+                                  limit: int = 100,
+                                  cursor: Optional[str] = None,
+                                  after_number: Optional[int] = None) -> Tuple[List[dict], Optional[str]]:
+        """
+        Получение страницы документов курсорной (keyset) пагинацией.
+
+        Вместо $skip страница ищется по составному индексу (folderId, number, _id) от последнего
+        выданного документа, поэтому время ответа не зависит от глубины страницы.
+        Возвращает документы и курсор следующей страницы (None, если страница последняя).
+
+        :param cursor: курсор из предыдущего ответа
+        :param after_number: начать с документов, номер которых больше указанного
+        """
+        match = {"folderId": folder_id}
+        if cursor:
+            last_number, last_id = self.decode_cursor(cursor)
+            # Номера в папке могут повторяться (разные версии), поэтому _id - дополнительный ключ сортировки
+            match["$or"] = [{"number": {"$gt": last_number}},
+                            {"number": last_number, "_id": {"$gt": last_id}}]
+        elif after_number is not None:
+            match["number"] = {"$gt": after_number}
+
+        # Берем на один документ больше, чтобы узнать, есть ли следующая страница
+        db_docs = self.collection.find(match).sort([("number", 1), ("_id", 1)]).limit(limit + 1)
+        db_docs = [doc async for doc in db_docs]
+        has_next = len(db_docs) > limit
+        result = await self.join_authors(db_docs=db_docs[:limit], um=um)
+        if has_next:
+            # Курсор - по последнему прочитанному документу, а не по последней строке ответа:
+            # документы без автора в ответ не попадают, и страница может оказаться пустой
+            return result, self.encode_cursor(db_docs[limit - 1])
+        return result, None
+
+    async def export_documents(self, *,
+                               folder_ids: List[OID],
+                               um: UserManager,
+                               export_format: str = 'ndjson') -> AsyncIterator[bytes]:
+        """
+        Потоковая выгрузка всех документов папок в формате NDJSON или CSV.
+
+        Документы читаются курсором пачками по EXPORT_BATCH_SIZE и сразу кодируются в байты
+        без построения Pydantic-моделей, поэтому расход памяти не зависит от размера папок.
+        """
+        folder_names = {folder_id: db_folder['name'] for folder_id, db_folder in
+                        (await self.folder_manager.get_many_by_ids(folder_ids, projection={'name': 1})).items()}
+        batch_size = self.config['EXPORT_BATCH_SIZE']
+        db_docs = self.collection.find({'folderId': {'$in': folder_ids}}, projection={PROJECT_COUNTED: 0}) \
+            .sort([('folderId', 1), ('number', 1)]) \
+            .batch_size(batch_size)
+
+        if export_format == 'csv':
+            # BOM нужен, чтобы Excel корректно открыл кириллицу
+            yield self._encode_csv_rows([EXPORT_CSV_COLUMNS], bom=True)
+
+        batch = []
+        async for db_doc in db_docs:
+            batch.append(db_doc)
+            if len(batch) >= batch_size:
+                yield await self._encode_export_batch(batch, folder_names, um, export_format)
+                batch = []
+        if batch:
+            yield await self._encode_export_batch(batch, folder_names, um, export_format)
+
+    @staticmethod
+    async def _encode_export_batch(batch: List[dict], folder_names: dict, um: UserManager, export_format: str) -> bytes:
+        authors = await um.get_authors(user_ids=[db_doc['authorId'] for db_doc in batch])
+        if export_format == 'csv':
+            rows = []
+            for db_doc in batch:
+                author = authors.get(db_doc['authorId'])
+                rows.append([
+                    folder_names.get(db_doc['folderId'], ''),
+                    db_doc['number'],
+                    db_doc.get('version', ''),
+                    db_doc.get('project', ''),
+                    db_doc.get('comment', ''),
+                    ' '.join(filter(None, [author.lastName, author.firstName, author.secondName])) if author else '',
+                    mongo_json_default(db_doc['created']) if db_doc.get('created') else '',
+                    str(db_doc['_id']),
+                ])
+            return DocumentManager._encode_csv_rows(rows)
+        lines = []
+        for db_doc in batch:
+            author = authors.get(db_doc['authorId'])
+            db_doc['folderName'] = folder_names.get(db_doc['folderId'], '')
+            db_doc['authorFullName'] = author.dict() if author else None
+            lines.append(json.dumps(db_doc, default=mongo_json_default, ensure_ascii=False))
+        lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+    @staticmethod
+    def _encode_csv_rows(rows: List[list], bom: bool = False) -> bytes:
+        buffer = io.StringIO()
+        if bom:
+            buffer.write('\ufeff')
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
+    async def touch_folders(self, folder_ids: Iterable[OID]):
+        """
+        Увеличивает версию списка документов папок (docsVersion) и сбрасывает их кэш.
+        Версия хранится в MongoDB, поэтому ETag страниц одинаков во всех воркерах и после перезапуска.
+        """
+        folder_ids = list(folder_ids)
+        await self.folder_collection.update_many({'_id': {'$in': folder_ids}}, {'$inc': {'docsVersion': 1}})
+        for folder_id in folder_ids:
+            self.folder_manager.forget(folder_id)
+            self.invalidate_cache_for_folder(folder_id)
+
     # Метод для очистки кэша документов при изменениях
-    def invalidate_cache_for_folder(self, folder_id: OID):
-        """Инвалидирует кэш документов для указанной папки"""
+    @staticmethod
+    def invalidate_cache_for_folder(folder_id: OID):
+        """Инвалидирует кэш документов и проектов для указанной папки"""
         folder_id_str = str(folder_id)
-        if folder_id_str in DOCUMENTS_CACHE:
-            # Если нужно сохранить часть кэша, можно удалить только ключи документов или проектов
-            # Здесь мы полностью удаляем все данные из кэша для папки
-            del DOCUMENTS_CACHE[folder_id_str]
-            print(f"Кэш для папки {folder_id_str} очищен")
-            
-    # Периодическая очистка устаревшего кэша (вызывается при запуске сервера)
+        removed_docs = DOCUMENTS_CACHE.pop(('documents', folder_id_str))
+        removed_projects = DOCUMENTS_CACHE.pop(('projects', folder_id_str))
+        if removed_docs is not None or removed_projects is not None:
+            logger.debug("Кэш для папки %s очищен", folder_id_str)
+
     @staticmethod
-    async def start_cache_cleanup_task():
-        """Запускает задачу для периодической очистки устаревшего кэша"""
-        async def cleanup_cache():
+    def start_cache_watcher(*, config: dict, db: AgnosticDatabase) -> asyncio.Task:
+        """
+        Запускает фоновое отслеживание изменений коллекций docs, folders, orgs и users через MongoDB change streams.
+
+        Каждый воркер сбрасывает свой кэш по событиям, которые порождены любым воркером,
+        поэтому кэш не отдает устаревшие данные до истечения TTL. Если change streams недоступны
+        (например, MongoDB запущена без replica set), задача завершается и остается только TTL;
+        при остальных ошибках кэши сбрасываются, а поток открывается заново.
+        """
+        mongo_db = db.client[config['MONGO_DB']]
+        pipeline = [
+            {'$match': {'ns.coll': {'$in': ['docs', 'folders', 'orgs', 'users']},
+                        'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}},
+            {'$project': {'ns': 1, 'operationType': 1, 'documentKey': 1, 'fullDocument.folderId': 1,
+                          'updateDescription.updatedFields': 1}},
+        ]
+
+        def handle_change(change: dict):
+            if change['ns']['coll'] == 'users':
+                # Деактивация и смена логина или пароля должны сразу действовать во всех воркерах
+                UserManager.invalidate_cached_user(str(change['documentKey']['_id']))
+                return
+            if change['ns']['coll'] == 'orgs':
+                OrgManager.invalidate_org(change['documentKey']['_id'])
+                return
+            if change['ns']['coll'] == 'folders':
+                DocumentManager.invalidate_cache_for_folder(change['documentKey']['_id'])
+                # Смена версии списка документов (touch_folders) резервы не затрагивает
+                updated_fields = (change.get('updateDescription') or {}).get('updatedFields', {})
+                if set(updated_fields) != {'docsVersion'}:
+                    FolderManager.invalidate_reserve_index(change['documentKey']['_id'])
+                return
+            folder_id = (change.get('fullDocument') or {}).get('folderId')
+            if folder_id is not None:
+                DocumentManager.invalidate_cache_for_folder(folder_id)
+                # Номера могли измениться в другом воркере - распределитель перестроится при следующем запросе
+                FolderManager.invalidate_number_allocator(folder_id)
+            else:
+                # Для удаленного документа папка неизвестна - сбрасываем кэш целиком
+                DOCUMENTS_CACHE.clear()
+                NUMBER_ALLOCATORS.clear()
+                logger.info("Кэш документов очищен: удален документ из неизвестной папки")
+
+        def clear_caches(*collections: str):
+            for coll in collections or WATCHED_CACHES:
+                for cache in WATCHED_CACHES[coll]:
+                    cache.clear()
+
+        async def watch_changes():
+            resume_token = None
+            started = False
             while True:
-                # Ждем некоторое время перед очисткой
-                await asyncio.sleep(CACHE_TTL * 2)
-                
-                # Текущее время
-                current_time = time.time()
-                
-                # Проверяем все записи в кэше
-                folders_to_remove = []
-                for folder_id, cache_data in DOCUMENTS_CACHE.items():
-                    cache_time = cache_data.get('timestamp', 0)
-                    
-                    # Если кэш устарел, добавляем его в список на удаление
-                    if current_time - cache_time > CACHE_TTL:
-                        folders_to_remove.append(folder_id)
-                
-                # Удаляем устаревшие записи
-                for folder_id in folders_to_remove:
-                    del DOCUMENTS_CACHE[folder_id]
-                    
-                print(f"Очистка кэша: удалено {len(folders_to_remove)} устаревших записей")
-        
-        # Запускаем задачу очистки в фоновом режиме
-        asyncio.create_task(cleanup_cache())
+                try:
+                    async with mongo_db.watch(pipeline,
+                                              full_document='updateLookup',
+                                              resume_after=resume_token) as stream:
+                        started = True
+                        logger.info("Отслеживание изменений для кэша документов запущено")
+                        async for change in stream:
+                            resume_token = stream.resume_token
+                            try:
+                                handle_change(change)
+                            except Exception:
+                                coll = (change.get('ns') or {}).get('coll')
+                                logger.exception("Не удалось обработать событие change stream коллекции %s", coll)
+                                # Событие потеряно - сбрасываем кэши его коллекции (или все, если она неизвестна)
+                                clear_caches(*([coll] if coll in WATCHED_CACHES else []))
+                except PyMongoError as e:
+                    if (not started and isinstance(e, OperationFailure)
+                            and e.code in CHANGE_STREAMS_UNSUPPORTED_CODES):
+                        logger.warning("Change streams недоступны, кэш документов работает только по TTL: %s", e)
+                        return
+                    logger.warning("Ошибка отслеживания изменений, переподключение через %s с: %s", CACHE_WATCHER_RETRY_DELAY, e)
+                    # Пропущенные за время переподключения события могут быть потеряны, а токен возобновления -
+                    # устареть (ChangeStreamHistoryLost), поэтому поток открывается заново с текущего момента
+                    resume_token = None
+                    clear_caches()
+                    await asyncio.sleep(CACHE_WATCHER_RETRY_DELAY)
+
+        def on_done(task: asyncio.Task):
+            if not task.cancelled() and task.exception() is not None:
+                logger.error("Отслеживание изменений для кэша документов аварийно завершено",
+                             exc_info=task.exception())
+
+        task = asyncio.create_task(watch_changes())
+        task.add_done_callback(on_done)
+        return task
 
     async def remove_document(self, *, doc_id: OID) -> bool:
         db_doc = await self.get_data_by_id(doc_id)
         if not db_doc:
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Документ не существует')
         doc = DocumentInfo(**db_doc)
-        org = await self.get_org(folder_id=doc.folderId)
-        if not self.who.isSuper and self.who.id not in org.canWrite:
+        if not self.can_write(await self.hierarchy.get_folder_access(doc.folderId)):
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав удалять документы')
-        await self.collection.delete_one({'_id': doc_id})
+        removed_db_doc = await self.collection.find_one_and_delete({'_id': doc_id},
+                                                                   projection={'project': 1, PROJECT_COUNTED: 1})
+        self.forget(doc_id)
         
-        # Инвалидируем кэш для папки
-        self.invalidate_cache_for_folder(doc.folderId)
+        await self.touch_folders([doc.folderId])
+        FolderManager.track_document_number(doc.folderId, doc_id, removed=doc.number)
+        if removed_db_doc and removed_db_doc.get(PROJECT_COUNTED):
+            await self.projects.track([(doc.folderId, removed_db_doc.get('project'), -1)])
         
         return True
 
@@ -261,68 +589,18 @@ class DocumentManager(BaseManager):
         # Проверяем кэш для каждой папки
         for folder_id in folder_ids:
             folder_id_str = str(folder_id)
-            if folder_id_str in DOCUMENTS_CACHE and 'projects' in DOCUMENTS_CACHE[folder_id_str]:
-                cache_entry = DOCUMENTS_CACHE[folder_id_str]
-                cache_time = cache_entry.get('timestamp', 0)
-                
-                # Проверяем, не устарел ли кэш
-                if time.time() - cache_time < CACHE_TTL:
-                    print(f"Используем кэшированные проекты для папки {folder_id_str}")
-                    result[folder_id_str] = cache_entry['projects']
-                else:
-                    uncached_folder_ids.append(folder_id)
+            cached_projects = DOCUMENTS_CACHE.get(('projects', folder_id_str))
+            if cached_projects is not None:
+                logger.debug("Используем кэшированные проекты для папки %s", folder_id_str)
+                result[folder_id_str] = cached_projects
             else:
                 uncached_folder_ids.append(folder_id)
         
-        # Если есть папки без кэша, запрашиваем их из базы данных
+        # Папки без кэша читаются одним запросом из индекса проектов
         if uncached_folder_ids:
-            # Используем агрегацию MongoDB для эффективного получения уникальных проектов
-            pipeline = [
-                # Фильтрация по списку папок
-                {"$match": {"folderId": {"$in": uncached_folder_ids}}},
-                
-                # Группировка по папке и проекту для получения уникальных значений
-                {"$group": {
-                    "_id": {
-                        "folderId": "$folderId", 
-                        "project": "$project"
-                    }
-                }},
-                
-                # Фильтрация пустых проектов
-                {"$match": {"_id.project": {"$ne": "", "$exists": True}}},
-                
-                # Группировка результатов по папке
-                {"$group": {
-                    "_id": "$_id.folderId",
-                    "projects": {"$push": "$_id.project"}
-                }},
-                
-                # Форматирование результата
-                {"$project": {
-                    "_id": 0,
-                    "folderId": {"$toString": "$_id"},
-                    "projects": 1
-                }}
-            ]
-            
-            # Выполняем агрегацию и собираем результаты
-            async for doc in self.collection.aggregate(pipeline):
-                folder_id_str = doc["folderId"]
-                projects = doc["projects"]
+            for folder_id_str, projects in (await self.projects.get_projects(uncached_folder_ids)).items():
                 result[folder_id_str] = projects
-                
-                # Сохраняем в кэш
-                if folder_id_str not in DOCUMENTS_CACHE:
-                    DOCUMENTS_CACHE[folder_id_str] = {}
-                
-                DOCUMENTS_CACHE[folder_id_str]['projects'] = projects
-                DOCUMENTS_CACHE[folder_id_str]['timestamp'] = time.time()
-        
-        # Добавляем пустые списки для папок, у которых нет проектов
-        for folder_id in folder_ids:
-            folder_id_str = str(folder_id)
-            if folder_id_str not in result:
-                result[folder_id_str] = []
-                
+                # Пустой результат тоже кэшируется
+                DOCUMENTS_CACHE.set(('projects', folder_id_str), projects)
+
         return result
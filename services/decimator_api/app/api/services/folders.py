@@ -1,17 +1,40 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import List, Optional
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 from fastapi import HTTPException
 from motor.core import AgnosticDatabase, AgnosticCollection
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 from starlette.status import HTTP_409_CONFLICT, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_403_FORBIDDEN
 
+from app.api.helpers.allocator import NumberAllocator
+from app.api.helpers.cache import TTLCache
+from app.api.helpers.intervals import ReserveIndex
+from app.api.helpers.loaders import forget
+from app.api.helpers.responses import row_shaper
 from app.api.models.folder import FolderInfo, FolderDB, Folder, Reserve
-from app.api.models.folder_group import FolderGroupInfo
-from app.api.models.org import OrgInfo
 from app.api.models.types import OID
 from app.api.models.user import UserInfo, UserUpdate
-from app.api.services.base import BaseManager
+from app.api.services.base import BaseManager, gather_independent
+from app.api.services.hierarchy import HierarchyIndex
+from app.api.services.projects import ProjectIndex
+
+# Кэш интервальных индексов резервов: {folder_id: ReserveIndex}
+# Отдельный в каждом воркере, поэтому используется только для подсказок свободных номеров и
+# предварительной проверки при создании резервов. Номера документов при записи проверяются по базе
+RESERVES_CACHE = TTLCache(maxsize=4096, ttl=300)
+# Распределители свободных номеров документов: {folder_id: NumberAllocator}
+NUMBER_ALLOCATORS = TTLCache(maxsize=1024, ttl=600)
+# Распределители, которые сейчас загружаются: {folder_id: число загрузок}, и изменения номеров
+# в этих папках за время загрузки: {folder_id: [(added, removed, doc_id), ...]}.
+# find мог не увидеть изменения, сделанные во время чтения, поэтому они применяются после загрузки
+ALLOCATOR_BUILDS = Counter()
+PENDING_NUMBER_CHANGES = {}
+# Код ошибки MongoDB при нарушении уникального индекса
+DUPLICATE_KEY_ERROR = 11000
 
 
 class FolderManager(BaseManager):
@@ -21,33 +44,229 @@ class FolderManager(BaseManager):
     info_model = FolderInfo
     db_info_model = FolderDB
 
-    org_collection: AgnosticCollection
-    fg_collection: AgnosticCollection
     doc_collection: AgnosticCollection
+    claim_collection: AgnosticCollection
+    hierarchy: HierarchyIndex
+    projects: ProjectIndex
 
     def __init__(self, *, config: dict, db: AgnosticDatabase, who: Optional[UserInfo] = None):
         super().__init__(config=config, db=db, who=who)
-        self.org_collection = db.client[self.config['MONGO_DB']]['orgs']
-        self.fg_collection = db.client[self.config['MONGO_DB']]['folder_groups']
         self.doc_collection = db.client[self.config['MONGO_DB']]['docs']
+        self.claim_collection = db.client[self.config['MONGO_DB']]['number_claims']
+        self.hierarchy = HierarchyIndex(config=config, db=db)
+        self.projects = ProjectIndex(config=config, db=db)
+
+    @staticmethod
+    def invalidate_reserve_index(folder_id: OID):
+        RESERVES_CACHE.pop(str(folder_id))
+        forget('folders', folder_id)
+
+    async def get_reserve_index(self, *, folder_id: OID) -> Optional[ReserveIndex]:
+        """
+        Интервальный индекс резервов папки (через кэш).
+        Индекс строится по границам резервов, без построения моделей. None - если папки нет.
+        """
+        reserve_index = RESERVES_CACHE.get(str(folder_id))
+        if reserve_index is None:
+            # Только границы резервов (без комментариев и авторов) и группа папки для кэша иерархии
+            db_folder = await self.collection.find_one({'_id': folder_id}, projection={'folderGroupId': 1,
+                                                                                      'reserves.from_': 1,
+                                                                                      'reserves.to_': 1})
+            if not db_folder:
+                return None
+            reserve_index = self.cache_reserve_index(db_folder)
+            HierarchyIndex.cache_folder(db_folder)
+        return reserve_index
+
+    async def is_number_reserved(self, *, folder_id: OID, number: int) -> Optional[bool]:
+        """
+        Попадает ли номер в резерв папки (None - если папки нет).
+        Проверяется одним запросом по актуальным данным: резерв мог только что создать другой воркер.
+        """
+        db_folder = await self.collection.find_one(
+            {'_id': folder_id},
+            projection={'reserves': {'$elemMatch': {'from_': {'$lte': number}, 'to_': {'$gte': number}}}},
+        )
+        if not db_folder:
+            return None
+        return bool(db_folder.get('reserves'))
+
+    @staticmethod
+    def cache_reserve_index(db_folder: dict) -> ReserveIndex:
+        """Строит индекс резервов по документу папки из MongoDB и сохраняет его в кэш"""
+        reserve_index = ReserveIndex.from_db(db_folder.get('reserves', []))
+        RESERVES_CACHE.set(str(db_folder['_id']), reserve_index)
+        return reserve_index
+
+    async def get_number_allocator(self, *, folder_id: OID) -> NumberAllocator:
+        """Распределитель номеров папки; строится один раз по индексу (folderId, number, _id)"""
+        key = str(folder_id)
+        allocator = NUMBER_ALLOCATORS.get(key)
+        if allocator is not None:
+            return allocator
+        ALLOCATOR_BUILDS[key] += 1
+        pending = PENDING_NUMBER_CHANGES.setdefault(key, [])
+        seen = len(pending)
+        try:
+            db_numbers = self.doc_collection.find({'folderId': folder_id}, projection={'number': 1})
+            allocator = NumberAllocator([(db_doc['number'], db_doc['_id']) async for db_doc in db_numbers])
+            # Учет документа повторно ничего не меняет, поэтому изменения применяются все,
+            # в том числе уже попавшие в результат find
+            for added, removed, doc_id in pending[seen:]:
+                self.apply_number_change(allocator, added=added, removed=removed, doc_id=doc_id)
+            NUMBER_ALLOCATORS.set(key, allocator)
+            return allocator
+        finally:
+            ALLOCATOR_BUILDS[key] -= 1
+            if not ALLOCATOR_BUILDS[key]:
+                del ALLOCATOR_BUILDS[key]
+                del PENDING_NUMBER_CHANGES[key]
+
+    async def get_claimed_numbers(self, *, folder_id: OID) -> Set[int]:
+        """Номера папки с действующими захватами (любых пользователей)"""
+        db_claims = self.claim_collection.find({'folderId': folder_id, 'expires': {'$gt': datetime.now(timezone.utc)}},
+                                               projection={'number': 1, '_id': 0})
+        return {db_claim['number'] async for db_claim in db_claims}
+
+    async def claim_numbers(self, *, folder_id: OID, numbers: List[int], expires: datetime) -> Set[int]:
+        """
+        Захватывает номера для текущего пользователя до expires одним insert_many и возвращает захваченные.
+        Уникальный индекс (folderId, number) не дает двум запросам из любых воркеров захватить один номер.
+        """
+        if not numbers:
+            return set()
+        try:
+            await self.claim_collection.insert_many([{'folderId': folder_id, 'number': number,
+                                                      'userId': self.who.id, 'expires': expires}
+                                                     for number in numbers], ordered=False)
+            return set(numbers)
+        except BulkWriteError as e:
+            write_errors = e.details['writeErrors']
+            if any(error['code'] != DUPLICATE_KEY_ERROR for error in write_errors):
+                raise
+            taken = {numbers[error['index']] for error in write_errors}
+        claimed = set(numbers) - taken
+        # Истекший захват удаляется TTL-индексом с задержкой (до минуты) - перехватываем его
+        now = datetime.now(timezone.utc)
+        db_expired = self.claim_collection.find({'folderId': folder_id, 'number': {'$in': list(taken)},
+                                                 'expires': {'$lte': now}},
+                                                projection={'number': 1, '_id': 0})
+        for number in [db_claim['number'] async for db_claim in db_expired]:
+            db_claim = await self.claim_collection.find_one_and_update(
+                {'folderId': folder_id, 'number': number, 'expires': {'$lte': now}},
+                {'$set': {'userId': self.who.id, 'expires': expires}},
+                projection={'_id': 1},
+            )
+            if db_claim is not None:
+                claimed.add(number)
+        return claimed
+
+    async def is_claimed_by_other(self, *, folder_id: OID, number: int) -> bool:
+        """Захвачен ли номер другим пользователем"""
+        db_claim = await self.claim_collection.find_one({'folderId': folder_id,
+                                                         'number': number,
+                                                         'userId': {'$ne': self.who.id},
+                                                         'expires': {'$gt': datetime.now(timezone.utc)}},
+                                                        projection={'_id': 1})
+        return db_claim is not None
+
+    async def get_numbers_claimed_by_others(self, *, numbers_by_folder: Dict[OID, Iterable[int]]) -> Set[Tuple[OID, int]]:
+        """Пары (папка, номер) из указанных, захваченные другими пользователями (одним запросом)"""
+        if not numbers_by_folder:
+            return set()
+        db_claims = self.claim_collection.find(
+            {'$or': [{'folderId': folder_id, 'number': {'$in': list(numbers)}}
+                     for folder_id, numbers in numbers_by_folder.items()],
+             'userId': {'$ne': self.who.id},
+             'expires': {'$gt': datetime.now(timezone.utc)}},
+            projection={'folderId': 1, 'number': 1, '_id': 0},
+        )
+        return {(db_claim['folderId'], db_claim['number']) async for db_claim in db_claims}
+
+    async def release_claims(self, *, folder_id: OID, numbers: Iterable[int]):
+        """Снимает захваты текущего пользователя с номеров, которые он использовал"""
+        await self.claim_collection.delete_many({'folderId': folder_id,
+                                                 'number': {'$in': list(numbers)},
+                                                 'userId': self.who.id})
 
-    async def get_org(self, *, fgs_id: OID) -> OrgInfo:
-        db_fg = await self.fg_collection.find_one({'_id': fgs_id})
-        fg = FolderGroupInfo(**db_fg)
-        db_org = await self.org_collection.find_one({'_id': fg.orgId})
-        return OrgInfo(**db_org)
+    async def next_numbers(self, *, folder_id: OID, count: int = 1, claim: bool = False) -> List[int]:
+        """
+        Наименьшие свободные номера документов папки (не заняты документами, резервами и захватами).
+        При claim=True номера захватываются, и другие пользователи их не получат, пока захват не истечет.
+        """
+        # Резервы читаются вместе с папкой: кэш индекса резервов мог не увидеть резерв из другого воркера
+        db_folder = await self.collection.find_one({'_id': folder_id}, projection={'folderGroupId': 1,
+                                                                                  'reserves.from_': 1,
+                                                                                  'reserves.to_': 1})
+        if not db_folder:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Папка не существует')
+        if claim:
+            if not self.can_write(await self.hierarchy.get_folder_group_access(db_folder['folderGroupId'])):
+                raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав создавать документы')
+        reserve_index = self.cache_reserve_index(db_folder)
+        allocator, claimed = await gather_independent(
+            self.get_number_allocator(folder_id=folder_id),
+            self.get_claimed_numbers(folder_id=folder_id),
+        )
+        if not claim:
+            return allocator.next_free(reserve_index, count=count, exclude=claimed)
+
+        expires = datetime.now(timezone.utc) + timedelta(seconds=self.config['NUMBER_CLAIM_TTL'])
+        result = []
+        start = 0
+        while len(result) < count:
+            candidates = allocator.next_free(reserve_index, count=count - len(result), start=start, exclude=claimed)
+            # Документы, созданные через другие воркеры, распределитель этого воркера мог еще не увидеть
+            db_docs = self.doc_collection.find({'folderId': folder_id, 'number': {'$in': candidates}},
+                                               projection={'number': 1, '_id': 0})
+            used = {db_doc['number'] async for db_doc in db_docs}
+            for number in used:
+                allocator.ensure(number)
+            free = [number for number in candidates if number not in used]
+            # Не захваченные номера заняты другими запросами - на следующем шаге вместо них берутся следующие
+            got = await self.claim_numbers(folder_id=folder_id, numbers=free, expires=expires)
+            result.extend(number for number in free if number in got)
+            claimed.update(number for number in free if number not in got)
+            start = candidates[-1] + 1
+        return result
+
+    @staticmethod
+    def track_document_number(folder_id: OID, doc_id: OID, *, added: Optional[int] = None,
+                              removed: Optional[int] = None):
+        """Обновляет распределитель номеров папки (если он загружен) при создании/изменении/удалении документа"""
+        key = str(folder_id)
+        if key in ALLOCATOR_BUILDS:
+            PENDING_NUMBER_CHANGES[key].append((added, removed, doc_id))
+        allocator = NUMBER_ALLOCATORS.get(key)
+        if allocator is not None:
+            FolderManager.apply_number_change(allocator, added=added, removed=removed, doc_id=doc_id)
+
+    @staticmethod
+    def apply_number_change(allocator: NumberAllocator, *, added: Optional[int], removed: Optional[int],
+                            doc_id: OID):
+        if removed is not None:
+            allocator.discard(removed, doc_id)
+        if added is not None:
+            allocator.add(added, doc_id)
+
+    @staticmethod
+    def invalidate_number_allocator(folder_id: OID):
+        NUMBER_ALLOCATORS.pop(str(folder_id))
 
     async def create_new(self, *, new_data: Folder) -> FolderInfo:
-        if not await self.is_entity_available(fields_filter={'name': new_data.name,
-                                                             'folderGroupId': new_data.folderGroupId}):
+        is_available, access = await gather_independent(
+            self.is_entity_available(fields_filter={'name': new_data.name, 'folderGroupId': new_data.folderGroupId}),
+            self.hierarchy.get_folder_group_access(new_data.folderGroupId),
+        )
+        if not is_available:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail=f'Название {new_data.name} уже занято')
-        org = await self.get_org(fgs_id=new_data.folderGroupId)
-        if not self.who.isSuper and self.who.id not in org.canWrite:
+        if not self.can_write(access):
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав создавать папки')
-        new_db_folder = await self.collection.insert_one(FolderDB(**new_data.mongo()).mongo())
+        folder_db = FolderDB(**new_data.mongo())
+        new_db_folder = await self.collection.insert_one(folder_db.mongo())
         if not new_db_folder:
             raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось создать папку')
-        return FolderInfo(**await self.get_data_by_id(new_db_folder.inserted_id))
+        return FolderInfo(**folder_db.mongo(), id=new_db_folder.inserted_id)
 
     async def update(self, *, folder_id: OID, new_name: str) -> FolderInfo:
         db_folder = await self.collection.find_one({'_id': folder_id})
@@ -60,12 +279,13 @@ class FolderManager(BaseManager):
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail=f'Название {new_name} уже занято')
 
         await self.collection.update_one({'_id': folder_id}, {'$set': folder.mongo()})
+        self.forget(folder_id)
         return folder
 
     async def is_entity_available(self, *, fields_filter: dict) -> bool:
         return False if await self.collection.find_one(fields_filter) else True
 
-    async def get_folders(self, *, fgs_id: OID, skip: int = 0, limit: int = 100, include_reserves: bool = False) -> List[FolderInfo]:
+    async def get_folders(self, *, fgs_id: OID, skip: int = 0, limit: int = 100, include_reserves: bool = False) -> List[dict]:
         """
         Получение папок с пагинацией и селективным включением полей для оптимизации
         
@@ -92,15 +312,9 @@ class FolderManager(BaseManager):
             projection=projection
         ).sort('name', 1).skip(skip).limit(limit)  # 1 означает по возрастанию
         
-        # Преобразуем результаты в модели
-        folders = []
-        async for db_folder in db_folders:
-            # Если reserves не были запрошены, добавляем пустой список для совместимости с моделью
-            if 'reserves' not in db_folder:
-                db_folder['reserves'] = []
-            folders.append(FolderInfo(**db_folder))
-            
-        return folders
+        # Строки в форме FolderInfo без построения моделей (reserves по умолчанию - пустой список)
+        shape = row_shaper(FolderInfo)
+        return [shape(db_folder) async for db_folder in db_folders]
 
     async def remove_folder(self, *, folder_id: OID) -> bool:
         db_folder = await self.get_data_by_id(folder_id)
@@ -109,44 +323,68 @@ class FolderManager(BaseManager):
         folder = FolderInfo(**db_folder)
         await self.doc_collection.delete_many({'folderId': folder.id})
         await self.collection.delete_one({'_id': folder.id})
+        self.invalidate_reserve_index(folder.id)
+        self.invalidate_number_allocator(folder.id)
+        await self.claim_collection.delete_many({'folderId': folder.id})
+        HierarchyIndex.invalidate_folder(folder.id)
+        await self.projects.remove_folder(folder.id)
         return True
 
     async def create_reserve(self, *, folder_id: OID, reserve: Reserve) -> FolderInfo:
-        db_folder = await self.get_data_by_id(folder_id)
-        if not db_folder:
+        # Индекс резервов заодно проверяет существование папки, а права берутся из кэша иерархии
+        reserve_index, access, docs_conflict = await gather_independent(
+            self.get_reserve_index(folder_id=folder_id),
+            self.hierarchy.get_folder_access(folder_id),
+            self.doc_collection.find_one({'folderId': folder_id, 'number': {'$gt': reserve.from_, '$lt': reserve.to_}},
+                                         projection={'_id': 1}),
+        )
+        if reserve_index is None:
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Папка не существует')
-        folder_info = FolderInfo(**db_folder)
-        org = await self.get_org(fgs_id=folder_info.folderGroupId)
-        if not self.who.isSuper and self.who.id not in org.canWrite:
+        if not self.can_write(access):
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав создавать резервы')
-        for existed_reserve in folder_info.reserves:
-            if (existed_reserve.from_ <= reserve.from_ <= existed_reserve.to_) or (
-                    existed_reserve.from_ <= reserve.to_ <= existed_reserve.to_):
-                raise HTTPException(status_code=HTTP_409_CONFLICT,
-                                    detail=f'Папка уже содержит резервы в указанном диапазоне')
-        docs_conflict = await self.doc_collection.find_one({'folderId': folder_id,
-                                                            'number': {'$gt': reserve.from_, '$lt': reserve.to_}})
+        # Быстрая проверка по кэшированному индексу, чтобы не делать заведомо неуспешную запись
+        if reserve_index.overlaps(reserve.from_, reserve.to_):
+            raise HTTPException(status_code=HTTP_409_CONFLICT,
+                                detail='Папка уже содержит резервы в указанном диапазоне')
         if docs_conflict:
             raise HTTPException(status_code=HTTP_409_CONFLICT,
-                                detail=f'Папка уже содержит документы в указанном диапазоне')
+                                detail='Папка уже содержит документы в указанном диапазоне')
         reserve.authorFullName = UserUpdate(**self.who.mongo())
-        folder_info.reserves.append(reserve)
-        await self.collection.update_one({'_id': folder_id}, {'$set': folder_info.mongo()})
-        return folder_info
+        # Условие отсутствия пересечений входит в фильтр, поэтому параллельные запросы
+        # не могут создать пересекающиеся резервы, а запись содержит только новый резерв
+        db_folder = await self.collection.find_one_and_update(
+            {'_id': folder_id,
+             'reserves': {'$not': {'$elemMatch': {'from_': {'$lte': reserve.to_}, 'to_': {'$gte': reserve.from_}}}}},
+            {'$push': {'reserves': reserve.dict()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        self.invalidate_reserve_index(folder_id)
+        if not db_folder:
+            raise HTTPException(status_code=HTTP_409_CONFLICT,
+                                detail='Папка уже содержит резервы в указанном диапазоне')
+        return FolderInfo(**db_folder)
 
     async def remove_reserve(self, *, folder_id: OID, reserve_id: OID) -> FolderInfo:
-        db_folder = await self.get_data_by_id(folder_id)
+        db_folder = await self.collection.find_one({'_id': folder_id}, projection={'folderGroupId': 1})
+        if not db_folder:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Папка не существует')
+        if not self.can_write(await self.hierarchy.get_folder_group_access(db_folder['folderGroupId'])):
+            raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав удалять резервы')
+        # Идентификаторы резервов хранятся как строками, так и ObjectId
+        reserve_ids = [reserve_id, str(reserve_id)]
+        reserve_filter = {'id': {'$in': reserve_ids}}
+        if not self.who.isSuper:
+            # Автор резерва проверяется в том же запросе, что и удаление
+            reserve_filter['authorId'] = {'$in': [self.who.id, str(self.who.id)]}
+        db_folder = await self.collection.find_one_and_update(
+            {'_id': folder_id},
+            {'$pull': {'reserves': reserve_filter}},
+            return_document=ReturnDocument.AFTER,
+        )
+        self.invalidate_reserve_index(folder_id)
         if not db_folder:
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Папка не существует')
-        folder_info = FolderInfo(**db_folder)
-        org = await self.get_org(fgs_id=folder_info.folderGroupId)
-        if not self.who.isSuper and self.who.id not in org.canWrite:
+        if any(reserve.get('id') in reserve_ids for reserve in db_folder.get('reserves', [])):
+            # Резерв остался - его создал другой пользователь
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав удалять резервы')
-        for reserve in folder_info.reserves:
-            if reserve.id != reserve_id:
-                continue
-            if reserve.authorId != self.who.id and not self.who.isSuper:
-                raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав удалять резервы')
-        folder_info.reserves = [reserve for reserve in folder_info.reserves if reserve.id != reserve_id]
-        await self.collection.update_one({'_id': folder_id}, {'$set': folder_info.mongo()})
-        return folder_info
+        return FolderInfo(**db_folder)
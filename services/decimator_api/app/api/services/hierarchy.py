@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from typing import NamedTuple, FrozenSet, Optional
+
+from bson import ObjectId
+from motor.core import AgnosticDatabase, AgnosticCollection
+
+from app.api.helpers.cache import TTLCache
+from app.api.helpers.loaders import forget, get_loaders
+
+# Иерархия папка -> группа папок -> организация практически не меняется, поэтому хранится долго
+FOLDER_GROUP_BY_FOLDER = TTLCache(maxsize=100000, ttl=3600)
+ORG_BY_FOLDER_GROUP = TTLCache(maxsize=10000, ttl=3600)
+# Права доступа к организациям: {org_id: OrgAccess}
+# Изменения состава сбрасывают запись только в своем воркере, в остальных - change stream
+# (CACHE_CHANGE_STREAMS) или истечение ORG_ACCESS_CACHE_TTL
+ORG_ACCESS = TTLCache(maxsize=10000, ttl=30)
+
+
+class OrgAccess(NamedTuple):
+    can_read: FrozenSet[ObjectId]
+    can_write: FrozenSet[ObjectId]
+    is_active: bool
+
+
+class HierarchyIndex:
+    """
+    Индекс иерархии folderId -> folderGroupId -> orgId и прав доступа организаций.
+
+    Записи загружаются лениво: папки - одним полем folderGroupId, группы и организации - через
+    загрузчики запроса (одновременные обращения к ним объединяются в один запрос). Записи хранятся
+    в общих для всех запросов кэшах, поэтому проверка прав сводится к поиску в словаре.
+    """
+
+    folder_collection: AgnosticCollection
+    fg_collection: AgnosticCollection
+    org_collection: AgnosticCollection
+
+    def __init__(self, *, config: dict, db: AgnosticDatabase):
+        mongo_db = db.client[config['MONGO_DB']]
+        self.folder_collection = mongo_db['folders']
+        self.fg_collection = mongo_db['folder_groups']
+        self.org_collection = mongo_db['orgs']
+
+    @staticmethod
+    def configure_cache(config: dict):
+        """Применяет настройки кэша прав доступа из конфигурации"""
+        ORG_ACCESS.configure(ttl=config['ORG_ACCESS_CACHE_TTL'])
+
+    async def get_folder_group_id(self, folder_id: ObjectId) -> Optional[ObjectId]:
+        fg_id = FOLDER_GROUP_BY_FOLDER.get(folder_id)
+        if fg_id is None:
+            # Нужна только группа папки: резервы и остальные поля не загружаются
+            db_folder = await self.folder_collection.find_one({'_id': folder_id}, {'folderGroupId': 1})
+            if not db_folder:
+                return None
+            fg_id = db_folder['folderGroupId']
+            FOLDER_GROUP_BY_FOLDER.set(folder_id, fg_id)
+        return fg_id
+
+    async def get_org_id(self, fg_id: ObjectId) -> Optional[ObjectId]:
+        org_id = ORG_BY_FOLDER_GROUP.get(fg_id)
+        if org_id is None:
+            db_fg = await get_loaders().get(self.fg_collection).load(fg_id)
+            if not db_fg:
+                return None
+            org_id = db_fg['orgId']
+            ORG_BY_FOLDER_GROUP.set(fg_id, org_id)
+        return org_id
+
+    async def get_org_access(self, org_id: ObjectId) -> Optional[OrgAccess]:
+        access = ORG_ACCESS.get(org_id)
+        if access is None:
+            db_org = await get_loaders().get(self.org_collection).load(org_id)
+            if not db_org:
+                return None
+            access = self.cache_org_access(db_org)
+        return access
+
+    async def get_folder_group_access(self, fg_id: ObjectId) -> Optional[OrgAccess]:
+        org_id = await self.get_org_id(fg_id)
+        return await self.get_org_access(org_id) if org_id else None
+
+    async def get_folder_access(self, folder_id: ObjectId) -> Optional[OrgAccess]:
+        fg_id = await self.get_folder_group_id(folder_id)
+        return await self.get_folder_group_access(fg_id) if fg_id else None
+
+    @staticmethod
+    def cache_org_access(db_org: dict) -> OrgAccess:
+        """Строит права доступа по документу организации из MongoDB и сохраняет их в кэш"""
+        access = OrgAccess(can_read=frozenset(db_org.get('canRead', [])),
+                           can_write=frozenset(db_org.get('canWrite', [])),
+                           is_active=db_org.get('isActive', True))
+        ORG_ACCESS.set(db_org['_id'], access)
+        return access
+
+    @staticmethod
+    def cache_folder(db_folder: dict):
+        """Запоминает группу папки по уже загруженному документу папки"""
+        FOLDER_GROUP_BY_FOLDER.set(db_folder['_id'], db_folder['folderGroupId'])
+
+    @staticmethod
+    def invalidate_org(org_id: ObjectId):
+        ORG_ACCESS.pop(org_id)
+        forget('orgs', org_id)
+
+    @staticmethod
+    def invalidate_folder(folder_id: ObjectId):
+        FOLDER_GROUP_BY_FOLDER.pop(folder_id)
+        forget('folders', folder_id)
+
+    @staticmethod
+    def invalidate_folder_group(fg_id: ObjectId):
+        ORG_BY_FOLDER_GROUP.pop(fg_id)
+        forget('folder_groups', fg_id)
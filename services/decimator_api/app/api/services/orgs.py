@@ -6,11 +6,20 @@ from fastapi import HTTPException
 from motor.core import AgnosticDatabase, AgnosticCollection
 from starlette.status import HTTP_409_CONFLICT, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_403_FORBIDDEN
 
+from app.api.helpers.cache import TTLCache
+from app.api.helpers.responses import row_shaper
 from app.api.models.folder_group import FolderGroup, FolderGroupInfo
 from app.api.models.org import OrgInfo, OrgDB, Org
 from app.api.models.types import OID
 from app.api.models.user import UserInfo
-from app.api.services.base import BaseManager
+from app.api.services.base import BaseManager, gather_independent
+from app.api.services.hierarchy import HierarchyIndex
+
+# Кэш списков доступных организаций: {user_id: List[dict]} (строки в форме OrgInfo), для суперпользователей общий ключ SUPER_ORGS_KEY
+# Изменения организаций сбрасывают кэш только в своем воркере, в остальных - change stream
+# (CACHE_CHANGE_STREAMS) или истечение ORGS_CACHE_TTL (по умолчанию как у ORG_ACCESS)
+ORGS_CACHE = TTLCache(maxsize=1024, ttl=30)
+SUPER_ORGS_KEY = '*'
 
 
 class OrgManager(BaseManager):
@@ -21,35 +30,73 @@ class OrgManager(BaseManager):
     db_info_model = OrgDB
 
     fg_collection: AgnosticCollection
+    hierarchy: HierarchyIndex
 
     def __init__(self, *, config: dict, db: AgnosticDatabase, who: Optional[UserInfo] = None):
         super().__init__(config=config, db=db, who=who)
         self.fg_collection = db.client[self.config['MONGO_DB']]['folder_groups']
+        self.hierarchy = HierarchyIndex(config=config, db=db)
+
+    @staticmethod
+    def configure_cache(config: dict):
+        """Применяет настройки кэша списков организаций из конфигурации"""
+        ORGS_CACHE.configure(maxsize=config['ORGS_CACHE_SIZE'], ttl=config['ORGS_CACHE_TTL'])
+
+    @staticmethod
+    def invalidate_org(org_id: OID):
+        """
+        Сбрасывает кэши после изменения организации.
+
+        Организации меняются редко и только суперпользователями, а изменение состава
+        затрагивает списки всех участников, поэтому кэш списков сбрасывается целиком.
+        """
+        HierarchyIndex.invalidate_org(org_id)
+        ORGS_CACHE.clear()
 
     async def create_new(self, new_data: Org) -> OrgInfo:
-        if not await self.is_entity_available(fields_filter={'name': new_data.name}):
+        name_available, code_available = await gather_independent(
+            self.is_entity_available(fields_filter={'name': new_data.name}),
+            self.is_entity_available(fields_filter={'code': new_data.code}),
+        )
+        if not name_available:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail=f'Название {new_data.name} уже занято')
-        if not await self.is_entity_available(fields_filter={'code': new_data.code}):
+        if not code_available:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail=f'Код {new_data.name} уже используется')
 
-        new_db_org = await self.collection.insert_one(OrgDB(**new_data.mongo(), canWrite=[self.who.id]).mongo())
+        org_db = OrgDB(**new_data.mongo(), canWrite=[self.who.id])
+        new_db_org = await self.collection.insert_one(org_db.mongo())
         if not new_db_org:
             raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось создать организацию')
-        return OrgInfo(**await self.get_data_by_id(new_db_org.inserted_id))
-
-    async def get_orgs(self) -> List[OrgInfo]:
+        self.invalidate_org(new_db_org.inserted_id)
+        return OrgInfo(**org_db.mongo(), id=new_db_org.inserted_id)
+
+    async def get_orgs(self) -> List[dict]:
+        cache_key = SUPER_ORGS_KEY if self.who.isSuper else str(self.who.id)
+        orgs = ORGS_CACHE.get(cache_key)
+        if orgs is not None:
+            return orgs
         if self.who.isSuper:
             access_filter = {}
         else:
             access_filter = {'isActive': True, '$or': [{'canRead': self.who.id}, {'canWrite': self.who.id}]}
         db_orgs = self.collection.find(access_filter)
-        return [OrgInfo(**db_org) async for db_org in db_orgs]
+        shape = row_shaper(OrgInfo)
+        orgs = [shape(db_org) async for db_org in db_orgs]
+        ORGS_CACHE.set(cache_key, orgs)
+        return orgs
+
+    async def get_org(self, *, org_id: OID) -> OrgInfo:
+        db_org = await self.get_data_by_id(org_id)
+        if not db_org:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Организация не существует')
+        return OrgInfo(**db_org)
 
     async def set_inactive(self, *, org_id: OID) -> OID:
         db_org = await self.get_active_data_by_id(org_id)
         if not db_org:
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Организация не существует')
         updated = await self.collection.update_one({'_id': org_id}, {'$set': {'isActive': False}})
+        self.invalidate_org(org_id)
         if updated.modified_count == 0:
             HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось удалить организацию')
         return org_id
@@ -59,6 +106,7 @@ class OrgManager(BaseManager):
         if not db_org:
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Организация не существует')
         updated = await self.collection.update_one({'_id': org_id}, {'$set': {'isActive': True}})
+        self.invalidate_org(org_id)
         if updated.modified_count == 0:
             HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось удалить организацию')
         return org_id
@@ -68,12 +116,14 @@ class OrgManager(BaseManager):
         if not db_org:
             raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Организация не существует')
         updated = await self.collection.update_one({'_id': _id}, {'$set': new_data.mongo()})
+        self.invalidate_org(_id)
         if updated.modified_count == 0:
             HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось удалить организацию')
         return _id
 
     async def create_folder_group(self, *, fg: FolderGroup, org_id: OID) -> FolderGroupInfo:
-        await self.ensure_existance(_ids=[org_id])
+        if not await self.ensure_existance(_ids=[org_id]):
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Организация не существует')
         copy = await self.fg_collection.find_one({'orgId': org_id, 'name': fg.name})
         if copy:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Такая группа папок уже существует')
@@ -81,43 +131,39 @@ class OrgManager(BaseManager):
         return FolderGroupInfo(**fg.dict(), _id=result.inserted_id)
 
     async def get_folder_groups(self, *, org_id: OID) -> List[FolderGroupInfo]:
-        org_info: OrgInfo = OrgInfo(**await self.get_data_by_id(_id=org_id))
-        if self.who.isSuper or self.who.id in org_info.canRead or self.who.id in org_info.canWrite:
+        access = await self.hierarchy.get_org_access(org_id)
+        if not access:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Организация не существует')
+        if self.who.isSuper or self.who.id in access.can_read or self.who.id in access.can_write:
             db_fgs = self.fg_collection.find({'orgId': org_id})
             return [FolderGroupInfo(**fg) async for fg in db_fgs]
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Нет прав')
 
     async def remove_users(self, *, user_ids: List[OID], org_id: OID) -> OID:
-        org_info: OrgInfo = OrgInfo(**await self.get_data_by_id(_id=org_id))
-        for user_id in user_ids:
-            if user_id in org_info.canRead:
-                org_info.canRead.remove(user_id)
-            if user_id in org_info.canWrite:
-                org_info.canWrite.remove(user_id)
-        updated_organization = await self.collection.update_one({'_id': org_id}, {'$set': {**org_info.mongo()}})
+        user_ids = list(dict.fromkeys(user_ids))
+        updated_organization = await self.collection.update_one(
+            {'_id': org_id},
+            {'$pull': {'canRead': {'$in': user_ids}, 'canWrite': {'$in': user_ids}}}
+        )
+        self.invalidate_org(org_id)
+        if updated_organization.matched_count == 0:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Организация не существует')
         if updated_organization.modified_count == 0:
             raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
                                 detail='Не удалось удалить пользователя из организации')
         return org_id
 
     async def add_users(self, *, user_ids: List[OID], org_id: OID, is_writer: bool) -> OID:
-        org_info: OrgInfo = OrgInfo(**await self.get_data_by_id(_id=org_id))
-        for user_id in user_ids:
-            if user_id in org_info.canRead and not is_writer:
-                continue
-            elif user_id in org_info.canRead and is_writer:
-                org_info.canRead.remove(user_id)
-                org_info.canWrite.append(user_id)
-            elif user_id in org_info.canWrite and not is_writer:
-                org_info.canWrite.remove(user_id)
-                org_info.canRead.append(user_id)
-            elif user_id in org_info.canWrite and is_writer:
-                continue
-            elif is_writer:
-                org_info.canWrite.append(user_id)
-            else:
-                org_info.canRead.append(user_id)
-        updated_organization = await self.collection.update_one({'_id': org_id}, {'$set': {**org_info.mongo()}})
+        # Пользователь состоит только в одном из списков: переносим его одной операцией
+        user_ids = list(dict.fromkeys(user_ids))
+        target, other = ('canWrite', 'canRead') if is_writer else ('canRead', 'canWrite')
+        updated_organization = await self.collection.update_one(
+            {'_id': org_id},
+            {'$addToSet': {target: {'$each': user_ids}}, '$pull': {other: {'$in': user_ids}}}
+        )
+        self.invalidate_org(org_id)
+        if updated_organization.matched_count == 0:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Организация не существует')
         if updated_organization.modified_count == 0:
             raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
                                 detail='Не удалось добавить пользователя в организацию')
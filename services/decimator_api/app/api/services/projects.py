@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from motor.core import AgnosticDatabase, AgnosticCollection
+from pymongo import UpdateOne
+
+# Папки, для которых индекс проектов уже построен (в этом процессе проверено по флагу в folders)
+INDEXED_FOLDERS = set()
+# Поле документа: проект документа учтен в счетчиках индекса
+PROJECT_COUNTED = 'projectCounted'
+
+
+class ProjectIndex:
+    """
+    Индекс проектов папок: коллекция folder_projects с документами {folderId, project, count}.
+
+    Счетчики обновляются через $inc при создании, изменении и удалении документов, поэтому
+    список проектов папок читается одним запросом по индексу (folderId, project) без агрегации
+    по документам. Документ, учтенный в счетчиках, помечается полем PROJECT_COUNTED в той же
+    записи, что меняет сам документ: при изменении и удалении вычитается только учтенный проект.
+    Документы, созданные до появления индекса, не помечены; они учитываются при первом чтении
+    папки (build), после чего в папке ставится флаг projectIndex.
+    """
+
+    collection: AgnosticCollection
+    doc_collection: AgnosticCollection
+    folder_collection: AgnosticCollection
+
+    def __init__(self, *, config: dict, db: AgnosticDatabase):
+        mongo_db = db.client[config['MONGO_DB']]
+        self.collection = mongo_db['folder_projects']
+        self.doc_collection = mongo_db['docs']
+        self.folder_collection = mongo_db['folders']
+
+    async def track(self, changes: Iterable[Tuple[ObjectId, Optional[str], int]]):
+        """
+        Применяет изменения счетчиков одним bulk_write.
+
+        :param changes: тройки (folderId, проект, +1/-1); пустые проекты не учитываются
+        """
+        deltas = Counter()
+        for folder_id, project, delta in changes:
+            if project:
+                deltas[(folder_id, project)] += delta
+        requests = [UpdateOne({'folderId': folder_id, 'project': project}, {'$inc': {'count': delta}}, upsert=True)
+                    for (folder_id, project), delta in deltas.items() if delta]
+        if requests:
+            await self.collection.bulk_write(requests, ordered=False)
+
+    async def get_projects(self, folder_ids: List[ObjectId]) -> Dict[str, List[str]]:
+        """Проекты папок (по алфавиту): {str(folder_id): [project, ...]}"""
+        await self.ensure_built(folder_ids)
+        result = {str(folder_id): [] for folder_id in folder_ids}
+        entries = self.collection.find({'folderId': {'$in': folder_ids}, 'count': {'$gt': 0}},
+                                       projection={'_id': 0, 'folderId': 1, 'project': 1}) \
+            .sort([('folderId', 1), ('project', 1)])
+        async for entry in entries:
+            result[str(entry['folderId'])].append(entry['project'])
+        return result
+
+    async def ensure_built(self, folder_ids: List[ObjectId]):
+        unknown = [folder_id for folder_id in folder_ids if folder_id not in INDEXED_FOLDERS]
+        if not unknown:
+            return
+        async for db_folder in self.folder_collection.find({'_id': {'$in': unknown}, 'projectIndex': True},
+                                                           projection={'_id': 1}):
+            INDEXED_FOLDERS.add(db_folder['_id'])
+        missing = [folder_id for folder_id in unknown if folder_id not in INDEXED_FOLDERS]
+        if missing:
+            await self.build(missing)
+
+    async def build(self, folder_ids: List[ObjectId]):
+        """
+        Учитывает в индексе непомеченные документы папок.
+
+        Документы помечаются через update_many с фильтром по проекту и отсутствию пометки,
+        и к счетчику прибавляется число действительно помеченных документов. Пометка каждого
+        документа атомарна, поэтому документ, измененный или удаленный во время построения,
+        и параллельное построение в другом процессе не учитываются дважды и не теряются.
+        """
+        unmarked = {'folderId': {'$in': folder_ids}, PROJECT_COUNTED: {'$ne': True}}
+        pipeline = [
+            {'$match': {**unmarked, 'project': {'$nin': ['', None]}}},
+            {'$group': {'_id': {'folderId': '$folderId', 'project': '$project'}}},
+        ]
+        changes = []
+        async for group in self.doc_collection.aggregate(pipeline):
+            folder_id, project = group['_id']['folderId'], group['_id']['project']
+            result = await self.doc_collection.update_many(
+                {'folderId': folder_id, 'project': project, PROJECT_COUNTED: {'$ne': True}},
+                {'$set': {PROJECT_COUNTED: True}},
+            )
+            changes.append((folder_id, project, result.modified_count))
+        await self.track(changes)
+        await self.folder_collection.update_many({'_id': {'$in': folder_ids}}, {'$set': {'projectIndex': True}})
+        INDEXED_FOLDERS.update(folder_ids)
+
+    async def remove_folder(self, folder_id: ObjectId):
+        await self.collection.delete_many({'folderId': folder_id})
+        INDEXED_FOLDERS.discard(folder_id)
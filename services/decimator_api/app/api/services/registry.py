@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from motor.core import AgnosticDatabase
+
+from app.api.services.documents import DocumentManager
+from app.api.services.folders import FolderManager
+from app.api.services.orgs import OrgManager
+from app.api.services.users import UserManager
+
+
+class Managers:
+    """
+    Менеджеры сервисов, создаваемые один раз при запуске приложения.
+
+    Дескрипторы коллекций и конфигурация общие для всех запросов,
+    на запрос создается только копия с текущим пользователем (BaseManager.for_user).
+    """
+
+    users: UserManager
+    orgs: OrgManager
+    folders: FolderManager
+    documents: DocumentManager
+
+    def __init__(self, *, config: dict, db: AgnosticDatabase):
+        self.users = UserManager(config=config, db=db)
+        self.orgs = OrgManager(config=config, db=db)
+        self.folders = FolderManager(config=config, db=db)
+        self.documents = DocumentManager(config=config, db=db)
@@ -1,14 +1,28 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from typing import Optional, List
+import time
+from typing import Optional, List, Dict, Iterable
 
-import bcrypt
+from bson import ObjectId
 from fastapi import HTTPException
+from pymongo import ReturnDocument
 from starlette.status import HTTP_409_CONFLICT, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND, HTTP_403_FORBIDDEN
 
+from app.api.helpers import passwords
+from app.api.helpers.cache import TTLCache
+from app.api.helpers.loaders import forget
+from app.api.helpers.responses import row_shaper
 from app.api.models.user import UserInfo, UserDB, UserCreate, UserLogin, UserUpdate, UserPassword
 from app.api.services.base import BaseManager
 
+# Кэш авторизованных пользователей по логину (subject JWT)
+# Избавляет от запроса к коллекции users на каждый запрос к API
+USERS_CACHE = TTLCache(maxsize=1024, ttl=30)
+# Кэш ФИО авторов документов и резервов: {ObjectId пользователя: UserUpdate}
+# Авторов немного и они редко меняются, поэтому кэш общий для всех запросов
+AUTHORS_CACHE = TTLCache(maxsize=10000, ttl=3600)
+AUTHOR_NAME_PROJECTION = {'firstName': 1, 'secondName': 1, 'lastName': 1}
+
 
 class UserManager(BaseManager):
     entity_name: str = 'User'
@@ -17,29 +31,77 @@ class UserManager(BaseManager):
     info_model = UserInfo
     db_info_model = UserDB
 
+    @staticmethod
+    def configure_cache(config: dict):
+        """Применяет настройки кэша пользователей из конфигурации"""
+        USERS_CACHE.configure(maxsize=config['USER_CACHE_SIZE'], ttl=config['USER_CACHE_TTL'])
+        AUTHORS_CACHE.configure(maxsize=config['AUTHORS_CACHE_SIZE'], ttl=config['AUTHORS_CACHE_TTL'])
+
+    @staticmethod
+    def invalidate_cached_user(user_id: str):
+        """Удаляет пользователя из кэша авторизованных пользователей и кэша авторов"""
+        USERS_CACHE.pop_where(lambda user: str(user.id) == str(user_id))
+        if ObjectId.is_valid(user_id):
+            AUTHORS_CACHE.pop(ObjectId(user_id))
+            forget('users', ObjectId(user_id))
+
+    async def get_authors(self, *, user_ids: Iterable[ObjectId]) -> Dict[ObjectId, UserUpdate]:
+        """
+        Получение ФИО авторов по списку идентификаторов через общий кэш авторов.
+
+        Отсутствующие в кэше авторы загружаются одним запросом с $in.
+        Несуществующие пользователи в результат не попадают.
+        """
+        authors = {}
+        missing = []
+        for user_id in set(user_ids):
+            author = AUTHORS_CACHE.get(user_id)
+            if author is None:
+                missing.append(user_id)
+            else:
+                authors[user_id] = author
+        if missing:
+            async for db_user in self.collection.find({'_id': {'$in': missing}}, projection=AUTHOR_NAME_PROJECTION):
+                author = UserUpdate(**db_user)
+                AUTHORS_CACHE.set(db_user['_id'], author)
+                authors[db_user['_id']] = author
+        return authors
+
+    async def get_cached_user_by_login(self, *, login: str) -> Optional[UserInfo]:
+        """Получение пользователя по логину через кэш (используется для авторизации запросов)"""
+        user = USERS_CACHE.get(login)
+        if user is None:
+            user = await self.get_user_by_login(login=login)
+            if user:
+                USERS_CACHE.set(login, user)
+        return user
+
     async def get_user_by_login(self, *, login: str) -> Optional[UserInfo]:
         db_user = await self.collection.find_one({'login': login})
         if db_user:
+            self.loader.prime(db_user)
             return UserInfo(**db_user)
         return None
     
     async def get_user_by_id(self, *, user_id: str) -> Optional[UserInfo]:
         from bson import ObjectId
-        db_user = await self.collection.find_one({'_id': ObjectId(user_id)})
+        db_user = await self.get_data_by_id(ObjectId(user_id))
         if db_user:
             return UserInfo(**db_user)
         return None
 
-    async def get_users(self) -> List[UserInfo]:
-        db_users = self.collection.find({})
-        return [UserInfo(**db_user) async for db_user in db_users]
+    async def get_users(self) -> List[dict]:
+        """Строки в форме UserInfo (без хэшей паролей) для MongoJSONResponse"""
+        shape = row_shaper(UserInfo)
+        db_users = self.collection.find({}, projection={'pwdHash': 0, 'pwdSalt': 0})
+        return [shape(db_user) async for db_user in db_users]
 
     async def create_new(self, *, new_data: UserCreate):
+        # Пароль хэшируется только для свободного логина: занятый логин не должен занимать пул bcrypt
         user_with_same_login = await self.get_user_by_login(login=new_data.login)
         if user_with_same_login:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Логин занят')
-        pwd_salt = bcrypt.gensalt()
-        pwd_hash = bcrypt.hashpw(new_data.password.encode(), pwd_salt)
+        pwd_hash, pwd_salt = await passwords.hash_password(new_data.password)
         user_db = UserDB(**{**new_data.mongo(), 'pwdHash': pwd_hash, 'pwdSalt': pwd_salt})
         db_inserted_user = await self.collection.insert_one(user_db.mongo())
         if db_inserted_user:
@@ -47,11 +109,17 @@ class UserManager(BaseManager):
         raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось создать нового пользователя')
 
     async def check_credentials(self, *, cred: UserLogin) -> bool:
+        started = time.perf_counter()
         db_user = await self.collection.find_one({'login': cred.login, 'isActive': True})
         if not db_user:
             return False
         user_with_hash = UserDB(**db_user)
-        return bcrypt.checkpw(cred.password.encode(), user_with_hash.pwdHash)
+        # Задержка входа учитывается только с проверкой хэша: быстрый отказ по неизвестному логину
+        # занижал бы ее и скрывал очередь bcrypt
+        try:
+            return await passwords.check_password(cred.password, user_with_hash.pwdHash)
+        finally:
+            passwords.LOGIN_LATENCY.observe(time.perf_counter() - started)
         
     async def update_user_password(self, *, user_id: str, new_password: UserPassword, current_user: UserInfo):
         from bson import ObjectId
@@ -59,16 +127,17 @@ class UserManager(BaseManager):
         if not current_user.isSuper and str(current_user.id) != user_id:
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Недостаточно прав для изменения пароля')
             
-        pwd_salt = bcrypt.gensalt()
-        pwd_hash = bcrypt.hashpw(new_password.password.encode(), pwd_salt)
+        pwd_hash, pwd_salt = await passwords.hash_password(new_password.password)
         
-        result = await self.collection.update_one(
+        db_user = await self.collection.find_one_and_update(
             {'_id': ObjectId(user_id)},
-            {'$set': {'pwdHash': pwd_hash, 'pwdSalt': pwd_salt}}
+            {'$set': {'pwdHash': pwd_hash, 'pwdSalt': pwd_salt}},
+            return_document=ReturnDocument.AFTER,
         )
+        self.invalidate_cached_user(user_id)
         
-        if result.modified_count:
-            return await self.get_user_by_id(user_id=user_id)
+        if db_user:
+            return UserInfo(**db_user)
         raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось обновить пароль пользователя')
     
     async def update_user_login(self, *, user_id: str, new_login: str, current_user: UserInfo):
@@ -82,13 +151,15 @@ class UserManager(BaseManager):
         if user_with_same_login:
             raise HTTPException(status_code=HTTP_409_CONFLICT, detail='Логин занят')
             
-        result = await self.collection.update_one(
+        db_user = await self.collection.find_one_and_update(
             {'_id': ObjectId(user_id)},
-            {'$set': {'login': new_login}}
+            {'$set': {'login': new_login}},
+            return_document=ReturnDocument.AFTER,
         )
+        self.invalidate_cached_user(user_id)
         
-        if result.modified_count:
-            return await self.get_user_by_id(user_id=user_id)
+        if db_user:
+            return UserInfo(**db_user)
         raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось обновить логин пользователя')
     
     async def delete_user(self, *, user_id: str, current_user: UserInfo):
@@ -97,15 +168,14 @@ class UserManager(BaseManager):
         if not current_user.isSuper:
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Недостаточно прав для удаления пользователя')
             
-        user = await self.get_user_by_id(user_id=user_id)
-        if not user:
-            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Пользователь не найден')
-            
         # Используем soft delete, устанавливая isActive в False
         result = await self.collection.update_one(
             {'_id': ObjectId(user_id)},
             {'$set': {'isActive': False}}
         )
+        if not result.matched_count:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail='Пользователь не найден')
+        self.invalidate_cached_user(user_id)
         
         if result.modified_count:
             return {'success': True, 'message': 'Пользователь деактивирован'}
@@ -117,11 +187,14 @@ class UserManager(BaseManager):
         if not current_user.isSuper:
             raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail='Недостаточно прав для восстановления пользователя')
             
-        result = await self.collection.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$set': {'isActive': True}}
+        # Фильтр по isActive: документ возвращается, только если пользователь действительно восстановлен
+        db_user = await self.collection.find_one_and_update(
+            {'_id': ObjectId(user_id), 'isActive': False},
+            {'$set': {'isActive': True}},
+            return_document=ReturnDocument.AFTER,
         )
+        self.invalidate_cached_user(user_id)
         
-        if result.modified_count:
-            return await self.get_user_by_id(user_id=user_id)
+        if db_user:
+            return UserInfo(**db_user)
         raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail='Не удалось восстановить пользователя')
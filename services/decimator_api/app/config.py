@@ -48,15 +48,66 @@ class BaseConfig(BaseModel):
 
     # Security
     SECRET_KEY: str = Secret(os.getenv('SECRET_KEY', 'Temporary key that should be replaced'))
+    # Стоимость bcrypt (log2 числа раундов) для новых хэшей паролей
+    BCRYPT_ROUNDS: int = os.getenv('BCRYPT_ROUNDS', 12)
+    # Пул потоков для хэширования паролей и ограничение одновременных операций
+    PASSWORD_HASH_WORKERS: int = os.getenv('PASSWORD_HASH_WORKERS', 4)
+    PASSWORD_HASH_CONCURRENCY: int = os.getenv('PASSWORD_HASH_CONCURRENCY', 16)
+    PASSWORD_HASH_QUEUE_TIMEOUT: float = os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 10)
 
     # Logging
     LOG_DIR: str = os.getenv('LOG_DIR', 'logs')
     LOG_LEVEL: int = os.getenv('LOG_LEVEL', logging.INFO)
     LOG_TO_STDOUT: bool = os.getenv('LOG_TO_STDOUT')
 
+    # Metrics
+    # Эндпоинт /metrics (формат Prometheus) и сбор длительностей запросов и команд MongoDB.
+    # Метрики раскрывают нагрузку по маршрутам и время входа, поэтому по умолчанию выключены
+    METRICS_ENABLED: bool = os.getenv('METRICS_ENABLED', False)
+    # Если задан, /metrics отдается только с заголовком Authorization: Bearer <METRICS_TOKEN>
+    METRICS_TOKEN: str = os.getenv('METRICS_TOKEN', '')
+
+    # Cache
+    # Кэш пользователей отдельный в каждом воркере: без CACHE_CHANGE_STREAMS деактивированный пользователь
+    # остается авторизованным в других воркерах до USER_CACHE_TTL секунд
+    USER_CACHE_TTL: int = os.getenv('USER_CACHE_TTL', 30)
+    USER_CACHE_SIZE: int = os.getenv('USER_CACHE_SIZE', 1024)
+    AUTHORS_CACHE_TTL: int = os.getenv('AUTHORS_CACHE_TTL', 3600)
+    AUTHORS_CACHE_SIZE: int = os.getenv('AUTHORS_CACHE_SIZE', 10000)
+    DOCUMENTS_CACHE_TTL: int = os.getenv('DOCUMENTS_CACHE_TTL', 60)
+    DOCUMENTS_CACHE_SIZE: int = os.getenv('DOCUMENTS_CACHE_SIZE', 256)
+    DOCUMENTS_CACHE_MAX_BYTES: int = os.getenv('DOCUMENTS_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+    # Права доступа к организациям кэшируются в каждом воркере: без CACHE_CHANGE_STREAMS пользователь,
+    # у которого отозвали права, сохраняет их в других воркерах до ORG_ACCESS_CACHE_TTL секунд
+    ORG_ACCESS_CACHE_TTL: int = os.getenv('ORG_ACCESS_CACHE_TTL', 30)
+    # Списки организаций пользователей тоже отдельные в каждом воркере: без CACHE_CHANGE_STREAMS исключенный
+    # из организации пользователь видит ее в списке других воркеров до ORGS_CACHE_TTL секунд
+    ORGS_CACHE_TTL: int = os.getenv('ORGS_CACHE_TTL', 30)
+    ORGS_CACHE_SIZE: int = os.getenv('ORGS_CACHE_SIZE', 1024)
+    # Межпроцессная инвалидация кэша через MongoDB change streams (требует replica set)
+    CACHE_CHANGE_STREAMS: bool = os.getenv('CACHE_CHANGE_STREAMS', False)
+
+    # Export / import
+    EXPORT_BATCH_SIZE: int = os.getenv('EXPORT_BATCH_SIZE', 1000)
+    BULK_MAX_DOCUMENTS: int = os.getenv('BULK_MAX_DOCUMENTS', 5000)
+
+    # Время удержания захваченных номеров документов в секундах
+    NUMBER_CLAIM_TTL: int = os.getenv('NUMBER_CLAIM_TTL', 300)
+
     # MongoDB
+    # Пул соединений отдельный в каждом процессе: всего соединений к серверу - до MAX_CONNECTIONS_COUNT
+    # на каждый воркер gunicorn
     MAX_CONNECTIONS_COUNT: int = os.getenv('MAX_CONNECTIONS_COUNT', 10)
     MIN_CONNECTIONS_COUNT: int = os.getenv('MIN_CONNECTIONS_COUNT', 10)
+    # Закрывать соединения, простаивающие дольше указанного (мс); 0 - не закрывать
+    MONGO_MAX_IDLE_TIME_MS: int = os.getenv('MONGO_MAX_IDLE_TIME_MS', 0)
+    # Сколько ждать свободного соединения из пула (мс) до ошибки; 0 - без ограничения
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 0)
+    # Сжатие трафика в порядке предпочтения через запятую: zstd (пакет zstandard), snappy (python-snappy), zlib
+    MONGO_COMPRESSORS: str = os.getenv('MONGO_COMPRESSORS', '')
+    # primary, primaryPreferred, secondary, secondaryPreferred или nearest.
+    # Чтение с вторичных узлов может не видеть только что записанные данные
+    MONGO_READ_PREFERENCE: str = os.getenv('MONGO_READ_PREFERENCE', 'primary')
     MONGO_URI: str = os.getenv('MONGO_URI', '')
     MONGO_HOST: str = os.getenv('MONGO_HOST', 'localhost')
     MONGO_PORT: int = int(os.getenv('MONGO_PORT', 27017))
@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from app.api.db.mongo_utils import connect_to_mongo, close_mongo_connection, drop_database
-from app.api.factory import create_app
+from app.api.db.mongodb import db
+from app.api.factory import create_app, configure_services
+from app.api.helpers import passwords
+from app.api.helpers.log import stop_logging
 from app.config import from_envvar
 from app.api.services.documents import DocumentManager
+from app.api.services.registry import Managers
 
 config = from_envvar()
 app = create_app(config)
+cache_watcher = None
 
 
 @app.on_event('startup')
@@ -16,15 +21,22 @@ async def init_db_connection():
     if config['TESTING']:
         # Clear test database on start testing
         await drop_database(config['MONGO_DB'])
-    
-    # Запускаем задачу очистки кэша документов
-    await DocumentManager.start_cache_cleanup_task()
-    print("Запущена задача периодической очистки кэша документов")
+
+    configure_services(config)
+    # Менеджеры и дескрипторы коллекций создаются один раз, на запрос - только копия с пользователем
+    app.managers = Managers(config=config, db=db)
+    if config['CACHE_CHANGE_STREAMS']:
+        global cache_watcher
+        cache_watcher = DocumentManager.start_cache_watcher(config=config, db=db)
 
 
 @app.on_event('shutdown')
 async def close_db_connection():
+    if cache_watcher:
+        cache_watcher.cancel()
+    passwords.shutdown()
     if config['TESTING']:
         # Clear test database on testing finishing
         await drop_database(config['MONGO_DB'])
     await close_mongo_connection()
+    stop_logging()
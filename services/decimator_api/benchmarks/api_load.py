@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный замер API: синтетический набор данных и прогон основных эндпоинтов внутри процесса.
+
+Приложение вызывается напрямую через httpx.ASGITransport (без сети и uvicorn), поэтому
+результаты отражают стоимость обработчиков, сервисов и запросов к базе. Отчет - JSON
+с пропускной способностью и перцентилями по каждому сценарию; его удобно сохранять
+через --output и сравнивать между коммитами.
+
+Запуск из services/decimator_api (база очищается перед замером):
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.api_load --backend mongo
+    python -m benchmarks.api_load --backend mock --docs 200 --requests 100
+
+Для --backend mock нужен пакет mongomock-motor, для обоих вариантов - httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from itertools import count
+from typing import Awaitable, Callable, Dict, List
+
+import bcrypt
+from bson import ObjectId
+
+os.environ.setdefault('ENV', 'production')
+
+from app.api.db.mongo_utils import client_options, create_indexes  # noqa: E402
+from app.api.db.mongodb import db  # noqa: E402
+from app.api.factory import create_app, configure_services  # noqa: E402
+from app.api.services.registry import Managers  # noqa: E402
+from app.config import from_envvar  # noqa: E402
+
+BENCH_LOGIN = 'bench'
+BENCH_PASSWORD = 'bench-password'
+# Раскладка номеров в папке: документы с 0, затем новые документы, резервы набора данных и резервы сценария
+SEED_RESERVES_START = 6000
+BENCH_RESERVES_START = 7000
+RESERVE_SIZE = 5
+
+
+def make_client(backend: str, config: dict):
+    if backend == 'mock':
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit('Для --backend mock установите mongomock-motor')
+        return AsyncMongoMockClient()
+    from motor.motor_asyncio import AsyncIOMotorClient
+    # Те же настройки пула, что и у приложения (MAX_CONNECTIONS_COUNT, MONGO_WAIT_QUEUE_TIMEOUT_MS и т.д.)
+    return AsyncIOMotorClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'), **client_options(config))
+
+
+async def seed(mongo_db, args) -> dict:
+    """Заполняет базу: организации -> группы папок -> папки с документами и резервами, пользователи"""
+    for collection in ('users', 'orgs', 'folder_groups', 'folders', 'docs'):
+        await mongo_db[collection].delete_many({})
+    now = datetime.now(timezone.utc)
+    # Минимальная стоимость bcrypt: замеряется API, а не хэширование при входе
+    pwd_salt = bcrypt.gensalt(rounds=4)
+    pwd_hash = bcrypt.hashpw(BENCH_PASSWORD.encode(), pwd_salt)
+    users = [{'_id': ObjectId(), 'firstName': f'Имя{i}', 'secondName': f'Отчество{i}', 'lastName': f'Фамилия{i}',
+              'login': BENCH_LOGIN if i == 0 else f'bench{i}', 'pwdHash': pwd_hash, 'pwdSalt': pwd_salt,
+              'isSuper': False, 'isActive': True, 'created': now}
+             for i in range(max(args.users, 1))]
+    await mongo_db['users'].insert_many(users)
+    user_ids = [user['_id'] for user in users]
+
+    orgs, folder_groups, folders, docs = [], [], [], []
+    for org_number in range(args.orgs):
+        org = {'_id': ObjectId(), 'name': f'Организация {org_number}', 'code': f'B{org_number:03d}'[:4],
+               'canRead': user_ids[1:], 'canWrite': user_ids[:1], 'isActive': True, 'created': now}
+        orgs.append(org)
+        for fg_number in range(args.folder_groups):
+            fg = {'_id': ObjectId(), 'orgId': org['_id'], 'name': f'Группа {fg_number}'}
+            folder_groups.append(fg)
+            for folder_number in range(args.folders):
+                folder = {'_id': ObjectId(), 'name': f'Папка {folder_number}', 'folderGroupId': fg['_id'],
+                          'created': now,
+                          'reserves': [{'id': ObjectId(), 'from_': SEED_RESERVES_START + i * 10,
+                                        'to_': SEED_RESERVES_START + i * 10 + RESERVE_SIZE - 1,
+                                        'authorId': random.choice(user_ids), 'description': 'Резерв',
+                                        'created': now}
+                                       for i in range(args.reserves)]}
+                folders.append(folder)
+                docs.extend({'_id': ObjectId(), 'authorId': random.choice(user_ids), 'folderId': folder['_id'],
+                             'project': f'Проект {number % args.projects}', 'comment': 'Комментарий к документу',
+                             'number': number, 'version': '', 'created': now}
+                            for number in range(args.docs))
+    await mongo_db['orgs'].insert_many(orgs)
+    await mongo_db['folder_groups'].insert_many(folder_groups)
+    await mongo_db['folders'].insert_many(folders)
+    if docs:
+        await mongo_db['docs'].insert_many(docs)
+    return {
+        'folder_ids': [str(folder['_id']) for folder in folders],
+        'fg_ids': [str(fg['_id']) for fg in folder_groups],
+        # Изменять документ может только его автор
+        'docs': [(str(doc['_id']), doc['number']) for doc in docs if doc['authorId'] == user_ids[0]],
+        'author_id': str(user_ids[0]),
+    }
+
+
+async def run_scenario(request: Callable[[int], Awaitable], *, requests: int, concurrency: int) -> dict:
+    """Выполняет `requests` запросов в `concurrency` параллельных потоков и считает перцентили"""
+    timings: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = count()
+
+    async def worker():
+        while True:
+            number = next(counter)
+            if number >= requests:
+                return
+            started = time.perf_counter()
+            response = await request(number)
+            timings.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    timings.sort()
+
+    def percentile(quantile: float) -> float:
+        rank = min(len(timings) - 1, max(0, int(round(quantile * len(timings))) - 1))
+        return round(timings[rank] * 1000, 3)
+
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(timings) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def main(args):
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit('Для замера установите httpx')
+
+    random.seed(args.seed)
+    config = from_envvar()
+    config['MONGO_DB'] = args.db
+    config['METRICS_ENABLED'] = False
+    app = create_app(config)
+    db.client = make_client(args.backend, config)
+    mongo_db = db.client[args.db]
+    data = await seed(mongo_db, args)
+    await create_indexes(config)
+    configure_services(config)
+    app.managers = Managers(config=config, db=db)
+
+    prefix = config['API_PREFIX']
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        response = await client.post(f'{prefix}/users/auth/login', json={'login': BENCH_LOGIN, 'password': BENCH_PASSWORD})
+        response.raise_for_status()
+        client.headers['Authorization'] = f'Bearer {response.json()["access_token"]}'
+
+        folder_ids, fg_ids, docs = data['folder_ids'], data['fg_ids'], data['docs']
+        next_doc_number = {folder_id: args.docs for folder_id in folder_ids}
+        next_reserve = {folder_id: 0 for folder_id in folder_ids}
+
+        def create_document(number: int):
+            folder_id = folder_ids[number % len(folder_ids)]
+            next_doc_number[folder_id] += 1
+            return client.post(f'{prefix}/documents/', json={
+                'authorId': data['author_id'], 'folderId': folder_id, 'comment': 'Новый документ',
+                'project': f'Проект {number % args.projects}', 'number': next_doc_number[folder_id] - 1})
+
+        def update_document(number: int):
+            doc_id, doc_number = docs[number % len(docs)]
+            return client.patch(f'{prefix}/documents/{doc_id}', json={
+                'comment': f'Изменение {number}', 'project': f'Проект {number % args.projects}',
+                'number': doc_number, 'version': ''})
+
+        def create_reserve(number: int):
+            folder_id = folder_ids[number % len(folder_ids)]
+            start = BENCH_RESERVES_START + next_reserve[folder_id] * RESERVE_SIZE
+            next_reserve[folder_id] += 1
+            return client.post(f'{prefix}/folders/{folder_id}/reserves', json={
+                'from_': start, 'to_': start + RESERVE_SIZE - 1, 'authorId': data['author_id'],
+                'description': 'Резерв замера'})
+
+        scenarios = {
+            'list_documents': lambda n: client.get(f'{prefix}/documents/', params={
+                'folder_id': folder_ids[n % len(folder_ids)], 'limit': args.page_size}),
+            'list_orgs': lambda n: client.get(f'{prefix}/orgs/'),
+            'list_folders': lambda n: client.get(f'{prefix}/folders/{fg_ids[n % len(fg_ids)]}',
+                                                 params={'include_reserves': True}),
+            'projects_by_folder_group': lambda n: client.get(
+                f'{prefix}/documents/by_folder_group/{fg_ids[n % len(fg_ids)]}'),
+            'create_document': create_document,
+            'update_document': update_document,
+            'create_reserve': create_reserve,
+        }
+        selected = args.scenarios.split(',') if args.scenarios else list(scenarios)
+        results = {}
+        for name in selected:
+            if docs or name != 'update_document':
+                results[name] = await run_scenario(scenarios[name], requests=args.requests,
+                                                   concurrency=args.concurrency)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'backend': args.backend,
+        'dataset': {'orgs': args.orgs, 'folder_groups': args.folder_groups, 'folders': args.folders,
+                    'docs': args.docs, 'reserves': args.reserves, 'users': args.users, 'projects': args.projects},
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'pool': {'max': config['MAX_CONNECTIONS_COUNT'], 'min': config['MIN_CONNECTIONS_COUNT']},
+        'scenarios': results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as report_file:
+            report_file.write(output)
+    await db.client.drop_database(args.db)
+    db.client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=('mongo', 'mock'), default='mongo')
+    parser.add_argument('--orgs', type=int, default=2)
+    parser.add_argument('--folder-groups', type=int, default=2, help='групп папок в каждой организации')
+    parser.add_argument('--folders', type=int, default=5, help='папок в каждой группе')
+    parser.add_argument('--docs', type=int, default=500, help='документов в каждой папке')
+    parser.add_argument('--reserves', type=int, default=10, help='резервов в каждой папке')
+    parser.add_argument('--projects', type=int, default=20, help='различных проектов в папке')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--scenarios', default='', help='сценарии через запятую (по умолчанию все)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', default='dec_bench')
+    parser.add_argument('--output', help='файл для сохранения отчета JSON')
+    arguments = parser.parse_args()
+    if arguments.docs > SEED_RESERVES_START or arguments.reserves > (BENCH_RESERVES_START - SEED_RESERVES_START) // 10:
+        parser.error('Слишком много документов или резервов для раскладки номеров в папке')
+    asyncio.run(main(arguments))
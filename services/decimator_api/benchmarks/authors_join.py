@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Сравнение получения документов папки с авторами: $lookup в агрегации против find + кэша авторов.
+
+Запуск из services/decimator_api (нужен доступный mongod, база очищается перед замером):
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.authors_join --docs 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.api.db.mongodb import DataBase
+from app.api.services.documents import DocumentManager
+from app.api.services.users import UserManager, AUTHORS_CACHE
+
+LOOKUP_PIPELINE_STAGES = [
+    {"$lookup": {"from": "users", "localField": "authorId", "foreignField": "_id", "as": "author"}},
+    {"$unwind": "$author"},
+    {"$project": {"_id": 1, "authorId": 1, "folderId": 1, "project": 1, "comment": 1, "number": 1,
+                  "version": 1, "created": 1,
+                  "authorFullName": {"firstName": "$author.firstName",
+                                     "secondName": "$author.secondName",
+                                     "lastName": "$author.lastName"}}},
+]
+
+
+async def seed(mongo_db, *, docs_count: int, authors_count: int) -> ObjectId:
+    await mongo_db['users'].delete_many({})
+    await mongo_db['docs'].delete_many({})
+    authors = [{'_id': ObjectId(), 'firstName': f'Имя{i}', 'secondName': f'Отчество{i}', 'lastName': f'Фамилия{i}',
+                'login': f'bench{i}', 'isSuper': False, 'isActive': True, 'created': datetime.now(timezone.utc)}
+               for i in range(authors_count)]
+    await mongo_db['users'].insert_many(authors)
+    folder_id = ObjectId()
+    await mongo_db['docs'].insert_many([
+        {'authorId': authors[i % authors_count]['_id'], 'folderId': folder_id, 'project': f'П{i % 50}',
+         'comment': 'Комментарий к документу', 'number': i, 'version': '', 'created': datetime.now(timezone.utc)}
+        for i in range(docs_count)
+    ])
+    await mongo_db['docs'].create_index([('folderId', 1), ('number', 1)])
+    return folder_id
+
+
+async def measure(func, repeats: int) -> dict:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {'mean_ms': round(statistics.mean(timings), 2), 'median_ms': round(statistics.median(timings), 2),
+            'min_ms': round(min(timings), 2)}
+
+
+async def main(args):
+    config = {'MONGO_DB': args.db}
+    db = DataBase()
+    db.client = AsyncIOMotorClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    mongo_db = db.client[args.db]
+    folder_id = await seed(mongo_db, docs_count=args.docs, authors_count=args.authors)
+    um = UserManager(config=config, db=db)
+    dm = DocumentManager(config=config, db=db)
+
+    async def with_lookup():
+        pipeline = [{"$match": {"folderId": folder_id}}, {"$sort": {"number": 1}}, *LOOKUP_PIPELINE_STAGES]
+        return [doc async for doc in dm.collection.aggregate(pipeline)]
+
+    async def with_authors_cache():
+        db_docs = [doc async for doc in dm.collection.find({"folderId": folder_id}).sort("number", 1)]
+        return await dm.join_authors(db_docs=db_docs, um=um)
+
+    async def with_lookup_models():
+        from app.api.models.document import DocumentWithAuthor
+        return [DocumentWithAuthor(**doc) for doc in await with_lookup()]
+
+    AUTHORS_CACHE.clear()
+    await with_authors_cache()  # Прогрев кэша авторов, как в работающем сервисе
+    report = {
+        'docs': args.docs,
+        'authors': args.authors,
+        'lookup_raw': await measure(with_lookup, args.repeats),
+        'lookup_models': await measure(with_lookup_models, args.repeats),
+        'find_authors_cache_rows': await measure(with_authors_cache, args.repeats),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    await db.client.drop_database(args.db)
+    db.client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=10000)
+    parser.add_argument('--authors', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--db', default='dec_bench')
+    asyncio.run(main(parser.parse_args()))
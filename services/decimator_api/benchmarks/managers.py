@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Стоимость подготовки менеджеров на запрос списка документов: создание DocumentManager и UserManager
+против копии менеджеров, созданных при запуске (Managers + BaseManager.for_user).
+
+База данных не нужна: клиент Motor не подключается до первого запроса.
+
+    python -m benchmarks.managers --repeats 20000
+"""
+import argparse
+import json
+import os
+import statistics
+import timeit
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+os.environ.setdefault('ENV', 'production')
+
+from app.api.db.mongodb import db  # noqa: E402
+from app.api.models.user import UserInfo  # noqa: E402
+from app.api.services.documents import DocumentManager  # noqa: E402
+from app.api.services.registry import Managers  # noqa: E402
+from app.api.services.users import UserManager  # noqa: E402
+from app.config import from_envvar  # noqa: E402
+
+
+def main(args):
+    config = from_envvar()
+    db.client = AsyncIOMotorClient('mongodb://localhost:27017', connect=False)
+    who = UserInfo(_id=ObjectId(), firstName='Иван', secondName='Иванович', lastName='Иванов', login='ivan',
+                   isSuper=False, isActive=True, created=datetime.now(timezone.utc))
+    managers = Managers(config=config, db=db)
+
+    def per_request():
+        # Как было в обработчике GET /documents/
+        UserManager(config=config, db=db)
+        DocumentManager(config=config, db=db, who=who)
+
+    def singleton():
+        managers.users
+        managers.documents.for_user(who)
+
+    def measure(func) -> dict:
+        runs = [timeit.timeit(func, number=args.repeats) / args.repeats * 1e6 for _ in range(args.rounds)]
+        return {'median_us': round(statistics.median(runs), 2), 'min_us': round(min(runs), 2)}
+
+    report = {
+        'repeats': args.repeats,
+        'per_request_construction': measure(per_request),
+        'startup_managers_for_user': measure(singleton),
+    }
+    report['speedup'] = round(report['per_request_construction']['median_us'] /
+                              report['startup_managers_for_user']['median_us'], 1)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    db.client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Сравнение сериализации списка документов: модели + response_model FastAPI против MongoJSONResponse.
+
+База данных не нужна: замеряется только путь от сырых словарей MongoDB до байтов ответа.
+
+    python -m benchmarks.serialization --rows 1000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import List
+
+from bson import ObjectId
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from starlette.responses import JSONResponse
+
+from app.api.helpers import responses
+from app.api.helpers.responses import MongoJSONResponse, row_shaper
+from app.api.models.document import DocumentWithAuthor
+
+
+def make_rows(count: int) -> List[dict]:
+    author = {'firstName': 'Иван', 'secondName': 'Иванович', 'lastName': 'Иванов'}
+    folder_id = ObjectId()
+    return [{'_id': ObjectId(), 'authorId': ObjectId(), 'folderId': folder_id, 'project': f'П{i % 50}',
+             'comment': 'Комментарий к документу', 'number': i, 'version': '', 'created': datetime.now(timezone.utc),
+             'authorFullName': dict(author)}
+            for i in range(count)]
+
+
+async def measure(func, repeats: int) -> dict:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {'mean_ms': round(statistics.mean(timings), 3), 'median_ms': round(statistics.median(timings), 3),
+            'min_ms': round(min(timings), 3)}
+
+
+async def main(args):
+    db_docs = make_rows(args.rows)
+    field = create_response_field(name='Response_get_documents', type_=List[DocumentWithAuthor])
+
+    async def response_model_path():
+        # Как было: модели в сервисе, затем повторная валидация и jsonable_encoder в FastAPI
+        models = [DocumentWithAuthor(**doc) for doc in db_docs]
+        content = await serialize_response(field=field, response_content=models)
+        return JSONResponse(content).body
+
+    async def fast_path():
+        shape = row_shaper(DocumentWithAuthor)
+        return MongoJSONResponse([shape(doc) for doc in db_docs]).body
+
+    # Ответы должны совпадать по содержимому
+    assert json.loads(await response_model_path()) == json.loads(await fast_path())
+
+    report = {
+        'rows': args.rows,
+        'orjson': responses.orjson is not None,
+        'response_model': await measure(response_model_path, args.repeats),
+        'mongo_json_response': await measure(fast_path, args.repeats),
+    }
+    report['speedup'] = round(report['response_model']['median_ms'] / report['mongo_json_response']['median_ms'], 1)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeats', type=int, default=50)
+    asyncio.run(main(parser.parse_args()))